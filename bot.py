@@ -4,6 +4,7 @@ from __future__ import print_function
 import os
 import queue
 import sys
+import threading
 import traceback
 import time
 
@@ -11,12 +12,18 @@ import time
 class Bot:
     def __init__(self):
         self.conns = {}
+        self.input_ready = threading.Event()  # set when any conn.out has data
         self.persist_dir = os.path.abspath('persist')
         if not os.path.exists(self.persist_dir):
             os.mkdir(self.persist_dir)
 
 bot = Bot()
 
+BATCH_SIZE = 20       # lines handled per connection before moving on
+RELOAD_INTERVAL = 1   # seconds between checks for changed plugins
+CONFIG_INTERVAL = 1   # seconds between checks for a changed config
+METRICS_INTERVAL = 60  # seconds between dumps of plugin metrics to persist/
+
 def main():
     sys.path += ['plugins']  # so 'import hook' works without duplication
     sys.path += ['lib']
@@ -30,6 +37,11 @@ def main():
          globals())
     reload(init=True)
 
+    if sys.argv[1:2] == ['--replay']:
+        print('Replaying traffic')
+        replay(sys.argv[2:])
+        return
+
     print('Connecting to IRC')
 
     try:
@@ -41,20 +53,41 @@ def main():
         traceback.print_exc()
         sys.exit()
 
+    bot.scheduler.restore()
+
     print('Running main loop')
 
+    # [next run, interval, name]; looked up by name so reloaded cores are used
+    timers = [[0, RELOAD_INTERVAL, 'reload'],  # these functions only do things
+              [0, CONFIG_INTERVAL, 'config'],  # if changes have occured
+              [time.time() + METRICS_INTERVAL, METRICS_INTERVAL, 'dump_metrics']]
+    backlog = False
+
     while True:
-        reload()  # these functions only do things
-        config()  # if changes have occured
+        now = time.time()
+        for timer in timers:
+            next_run, interval, name = timer
+            if next_run <= now:
+                globals()[name]()
+                timer[0] = now + interval
+
+        if not backlog:
+            timeout = min(timer[0] for timer in timers) - time.time()
+            bot.input_ready.wait(max(timeout, 0))
+        bot.input_ready.clear()
 
-        for conn in bot.conns.values():
-            try:
-                out = conn.out.get_nowait()
+        # handle a batch from every connection in turn, so a busy one can't
+        # starve the others
+        backlog = False
+        for conn in list(bot.conns.values()):
+            for _ in range(BATCH_SIZE):
+                try:
+                    out = conn.out.get_nowait()
+                except queue.Empty:
+                    break
                 main(conn, out)
-            except queue.Empty:
-                pass
-        while all(conn.out.empty() for conn in iter(bot.conns.values())):
-            time.sleep(.1)
+            else:
+                backlog = True
 
 if __name__ == '__main__':
     main()
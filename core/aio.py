@@ -0,0 +1,92 @@
+from __future__ import print_function
+
+import time
+import _thread
+
+try:
+    import asyncio
+except ImportError:  # python 2, which can't define async plugins anyway
+    asyncio = None
+
+
+def run_event_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def start_coroutine(call):
+    "starts an async plugin call; runs on the event loop's thread"
+    func, input = call.func, call.input
+    try:
+        if 'db' in func._args and 'db' not in input:
+            input.db = get_db_connection(input.conn)
+
+        coro = func._call(input)
+        timeout = call_timeout(func)
+        if timeout:
+            coro = asyncio.wait_for(coro, timeout)
+
+        task = bot.loop.create_task(coro)
+    except Exception:
+        end_call(call)
+        if 'cache_key' in input:
+            bot.result_cache.fail(input.cache_key)
+        bot.logger.exception('plugin', plugin=plugin_name(func))
+        return
+    task.add_done_callback(lambda task: finish_coroutine(call, task))
+
+
+def finish_coroutine(call, task):
+    end_call(call)
+    func, input = call.func, call.input
+    elapsed = time.time() - call.started
+    try:
+        out = task.result()
+    except asyncio.TimeoutError:
+        bot.metrics.record(func, elapsed, error=True)
+        message = '%s timed out after %ds' % (
+            getattr(input, 'trigger', plugin_name(func)), elapsed)
+        if 'cache_key' in input:
+            bot.result_cache.fail(input.cache_key, message)
+        if 'trigger' in input:  # someone is waiting on a command
+            input.reply(message)
+        return
+    except asyncio.CancelledError:  # not an Exception since python 3.8
+        bot.metrics.record(func, elapsed, error=True)
+        if 'cache_key' in input:
+            bot.result_cache.fail(input.cache_key)
+        return
+    except Exception:
+        bot.metrics.record(func, elapsed, error=True)
+        if 'cache_key' in input:
+            bot.result_cache.fail(input.cache_key)
+        bot.logger.exception('plugin', plugin=plugin_name(func))
+        return
+
+    bot.metrics.record(func, elapsed)
+    if 'cache_key' in input:
+        bot.result_cache.store(input.cache_key, out)
+
+    if out is not None:
+        input.reply(str(out))
+
+
+def submit_coroutine(func, input):
+    """starts an async plugin call on the event loop, returning False if too
+    many calls to func are already running (as the workers would)"""
+    limit = getattr(func, '_concurrency', None) or bot.workers.plugin_limit
+    if limit and input.lane == 'normal':
+        running = sum(1 for call in list(bot.calls.values())
+                      if call.coroutine and call.func is func)
+        if running >= limit:
+            return False
+    call = start_call(func, input, coroutine=True)  # seen by the watchdog
+    bot.loop.call_soon_threadsafe(start_coroutine, call)
+    return True
+
+
+if not hasattr(bot, 'loop'):
+    bot.loop = None
+    if asyncio is not None:
+        bot.loop = asyncio.new_event_loop()  # shared by every async plugin
+        _thread.start_new_thread(run_event_loop, (bot.loop,))
@@ -0,0 +1,165 @@
+import collections
+import time
+import _thread
+
+
+class CacheEntry(object):
+
+    "a cached reply, or a call in progress and the inputs waiting on it"
+
+    __slots__ = ('value', 'expires', 'waiting')
+
+    def __init__(self):
+        self.value = None
+        self.expires = None  # None while the first call is still running
+        self.waiting = []
+
+
+def cache_key(func, inp):
+    key = func._cached['key']
+    if key is not None:
+        return func, key(inp)
+    if hasattr(inp, 'group'):  # regex match
+        return func, inp.group(0)
+    return func, inp
+
+
+class ResultCache(object):
+
+    '''LRU cache of the replies of @hook.cached plugins'''
+
+    def __init__(self, size=500):
+        self.lock = _thread.allocate_lock()
+        self.entries = collections.OrderedDict()  # least recently used first
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0  # calls that waited on an identical one in progress
+        self.clock = time.time  # replays follow the recorded time instead
+
+    def fetch(self, func, input):
+        """answers input from the cache, or has it wait on an identical call
+        in progress; returns True if func has to be called after all"""
+        key = cache_key(func, input.inp)
+        if key[1] is None:  # key() opted out of caching this input
+            return True
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry  # now the most recently used
+                if entry.expires is None:
+                    self.waits += 1
+                    entry.waiting.append(input)
+                    return False
+                if entry.expires <= self.clock():
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                input.cache_key = key
+                self.entries[key] = CacheEntry()
+                self.evict()
+                return True
+
+            self.hits += 1
+            value = entry.value
+
+        if value is not None:
+            input.reply(str(value))
+        return False
+
+    def evict(self):
+        "drops the least recently used replies; calls in progress stay"
+        excess = len(self.entries) - self.size
+        if excess <= 0:
+            return
+        done = []
+        for key, entry in self.entries.items():
+            if entry.expires is not None:  # or its waiters would be lost
+                done.append(key)
+                if len(done) == excess:
+                    break
+        for key in done:
+            del self.entries[key]
+
+    def store(self, key, value):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:  # evicted while the call ran
+                entry = self.entries[key] = CacheEntry()
+            waiting, entry.waiting = entry.waiting, []
+            entry.value = value
+            entry.expires = self.clock() + key[0]._cached['ttl']
+            self.evict()  # in case it was held back while in progress
+
+        if value is not None:
+            for input in waiting:
+                input.reply(str(value))
+
+    def fail(self, key, message=None):
+        """forgets a call that didn't produce a reply. Commands waiting on it
+        are told message if there is one, otherwise they are called again"""
+        waiting = []
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires is None:
+                del self.entries[key]
+                waiting = entry.waiting
+
+        func = key[0]
+        for input in waiting:
+            if message is not None:
+                if 'trigger' in input:
+                    input.reply(message)
+            elif self.fetch(func, input):  # the first becomes the new call
+                submit(func, input)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses, 'waits': self.waits}
+
+
+def test_result_cache_fail():
+    class FakeInput(object):
+        def __init__(self, inp, trigger=None):
+            self.inp = inp
+            self.replies = []
+            if trigger:
+                self.trigger = trigger
+
+        def __contains__(self, key):
+            return hasattr(self, key)
+
+        def reply(self, msg):
+            self.replies.append(msg)
+
+    def func(inp):
+        pass
+    func._cached = {'ttl': 60, 'key': None}
+
+    cache = ResultCache()
+    first, second = FakeInput('x', 'w'), FakeInput('x', 'w')
+    assert cache.fetch(func, first)
+    assert not cache.fetch(func, second)  # waits on the first
+    cache.fail(first.cache_key, 'w timed out after 60s')
+    assert second.replies == ['w timed out after 60s']
+    assert cache.fetch(func, FakeInput('x'))  # not stuck in progress
+
+    cache = ResultCache(size=1)  # two calls in flight don't evict each other
+    first, second = FakeInput('a', 'w'), FakeInput('b', 'w')
+    waiting = FakeInput('a', 'w')
+    assert cache.fetch(func, first)
+    assert cache.fetch(func, second)
+    assert not cache.fetch(func, waiting)
+    cache.store(first.cache_key, 'result')
+    assert waiting.replies == ['result']
+    cache.store(second.cache_key, 'other')
+    assert len(cache.entries) == 1
+
+    func._cached['key'] = lambda inp: inp or None
+    assert cache.fetch(func, FakeInput(''))
+    assert cache.fetch(func, FakeInput(''))  # not cached, so not waiting
+
+
+if not hasattr(bot, 'result_cache'):
+    bot.result_cache = ResultCache()
@@ -53,6 +53,14 @@ def config():
             bot.config = json.load(open(find_config()))
             bot._config_mtime = config_mtime
 
+            bot.logger.configure(bot.config)
+
+            start_cpu_pool(bot.config.get('cpu_processes', 2))
+            bot.workers.configure(bot.config.get('worker_threads', 16),
+                                  bot.config.get('worker_queue', 100),
+                                  bot.config.get('plugin_concurrency', 8))
+            bot.result_cache.size = bot.config.get('cache_size', 500)
+
             for name, conf in bot.config['connections'].items():
                 conf.setdefault('censored_strings', bot.config.get('censored_strings', []))
 
@@ -64,7 +72,7 @@ def config():
                     else:
                         bot.conns[name] = IRC(conf)
         except ValueError as e:
-            print('ERROR: malformed config!', e)
+            bot.logger.error('core', 'ERROR: malformed config! %s' % e)
 
 
 bot._config_mtime = 0
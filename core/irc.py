@@ -1,6 +1,6 @@
 from __future__ import print_function
-from builtins import map
 from builtins import object
+import collections
 import re
 import socket
 import time
@@ -14,6 +14,13 @@ DEFAULT_NAME = 'skybot'
 DEFAULT_REALNAME = 'Python bot - http://github.com/rmmh/skybot'
 DEFAULT_NICKSERV_NAME = 'nickserv'
 DEFAULT_NICKSERV_COMMAND = 'IDENTIFY %s'
+DEFAULT_FLOOD_BURST = 5  # lines that can be sent at once, once paced
+DEFAULT_FLOOD_RATE = 0  # lines per second after a burst; 0 doesn't pace
+MAX_WRITE_LINES = 50  # most lines joined into one write without a limit
+MAX_LINE_BYTES = 510  # a line is at most 512 bytes, including its crlf
+MAX_USER_LEN = 10  # lengths of our user and host, until the server says
+MAX_HOST_LEN = 63
+SPLITTABLE_COMMANDS = ('PRIVMSG', 'NOTICE')  # others get truncated instead
 
 
 def decode(txt):
@@ -26,18 +33,346 @@ def decode(txt):
     return txt.decode('utf-8', 'ignore')
 
 
-def censor(text, censored_strings = None):
-    text = re.sub("[\n\r]+", " ", text)
-
-    if not censored_strings:
-        return text
-
-    words = map(re.escape, censored_strings)
-    pattern = "(%s)" % "|".join(words)
-
-    text = re.sub(pattern, "[censored]", text)
-
-    return text
+TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def unescape_tag(value):
+    "decodes the escapes in an IRCv3 message tag's value"
+    if '\\' not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')  # a lone trailing backslash is dropped
+            char = TAG_ESCAPES.get(char, char)
+        out.append(char)
+    return ''.join(out)
+
+
+class Message(object):
+
+    '''A line from the server, split into its parts in one pass'''
+
+    __slots__ = ('raw', 'raw_tags', 'prefix', 'command', 'params', 'nick',
+                 'user', 'host', 'paraml', 'lastparam', '_tags')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._tags = None
+        end = len(raw)
+        pos = 0
+
+        self.raw_tags = ''
+        if raw[:1] == '@':  # @tag=value;tag :prefix COMMAND params
+            space = raw.find(' ')
+            if space < 0:
+                space = end
+            self.raw_tags = raw[1:space]
+            pos = space + 1
+
+        prefix = ''
+        if raw[pos:pos + 1] == ':':
+            space = raw.find(' ', pos)
+            if space < 0:
+                space = end
+            prefix = raw[pos:space]
+            pos = space + 1
+        self.prefix = prefix
+
+        space = raw.find(' ', pos)
+        if space < 0:
+            space = end
+        self.command = raw[pos:space]
+        self.params = params = raw[space + 1:]
+
+        if params[:1] == ':':
+            paraml = [params[1:]]
+        else:
+            trailing = params.find(' :')
+            paraml = params[:trailing].split(' ') if trailing >= 0 else \
+                params.split(' ')
+            if '' in paraml:  # runs of spaces, or no params at all
+                paraml = [param for param in paraml if param]
+            if trailing >= 0:
+                paraml.append(params[trailing + 2:])
+        self.paraml = paraml
+        self.lastparam = paraml[-1] if paraml else ''
+
+        # nick!user@host, or just a server name
+        nick, _, self.host = prefix[1:].partition('@')
+        self.nick, _, self.user = nick.partition('!')
+
+    @property
+    def tags(self):
+        "the message's IRCv3 tags, decoded the first time they're used"
+        if self._tags is None:
+            tags = {}
+            for tag in self.raw_tags.split(';'):
+                key, _, value = tag.partition('=')
+                if key:
+                    tags[key] = unescape_tag(value)
+            self._tags = tags
+        return self._tags
+
+
+def test_message():
+    msg = Message(':bob!~b@example.com PRIVMSG #test :hello  there')
+    assert msg.prefix == ':bob!~b@example.com'
+    assert (msg.nick, msg.user, msg.host) == ('bob', '~b', 'example.com')
+    assert msg.command == 'PRIVMSG'
+    assert msg.params == '#test :hello  there'
+    assert msg.paraml == ['#test', 'hello  there']
+    assert msg.lastparam == 'hello  there'
+    assert msg.tags == {}
+
+    msg = Message('PING :irc.example.com')
+    assert (msg.prefix, msg.nick, msg.command) == ('', '', 'PING')
+    assert msg.paraml == ['irc.example.com']
+
+    msg = Message(':irc.example.com 005 bot  A=1 B :are supported')
+    assert (msg.nick, msg.user, msg.host) == ('irc.example.com', '', '')
+    assert msg.paraml == ['bot', 'A=1', 'B', 'are supported']
+
+    msg = Message(':bob!~b@host MODE #test +o :')
+    assert msg.paraml == ['#test', '+o', '']
+    assert msg.lastparam == ''
+
+    msg = Message(':a!b!c@d@e AWAY')
+    assert (msg.nick, msg.user, msg.host) == ('a', 'b!c', 'd@e')
+    assert (msg.command, msg.params, msg.paraml) == ('AWAY', '', [])
+    assert Message(':a@b!c X').host == 'b!c'
+
+    msg = Message('@time=2020-01-01T00:00:00.000Z;msgid=a\\sb\\:c\\\\;+draft '
+                  ':bob!~b@host PRIVMSG #test :hi')
+    assert msg.raw_tags.startswith('time=')
+    assert msg.nick == 'bob'
+    assert msg.lastparam == 'hi'
+    assert msg.tags == {'time': '2020-01-01T00:00:00.000Z',
+                        'msgid': 'a b;c\\', '+draft': ''}
+    assert unescape_tag('x\\') == 'x'
+    assert unescape_tag('\\q\\r\\n') == 'q\r\n'
+
+
+NEWLINES_RE = re.compile('[\n\r]+')
+
+
+def utf8_cut(data, limit):
+    "the largest cut no longer than limit that doesn't split a utf-8 character"
+    if len(data) <= limit:
+        return len(data)
+    while limit > 0 and 0x80 <= bytearray(data[limit:limit + 1])[0] < 0xc0:
+        limit -= 1  # a continuation byte
+    return limit
+
+
+def utf8_width(data):
+    "the length in bytes of the utf-8 character data starts with"
+    width = 1
+    while width < len(data) and \
+            0x80 <= bytearray(data[width:width + 1])[0] < 0xc0:
+        width += 1
+    return width
+
+
+def split_utf8(text, limit):
+    "splits text into pieces of at most limit bytes, between words if possible"
+    data = text.encode('utf-8')
+    pieces = []
+    while len(data) > limit:
+        cut = utf8_cut(data, limit) or utf8_width(data)  # at least a character
+        space = data.rfind(b' ', 0, cut + 1)
+        if space > limit // 2:  # don't leave a very short piece
+            pieces.append(data[:space])
+            data = data[space + 1:]
+        else:
+            pieces.append(data[:cut])
+            data = data[cut:]
+    if data or not pieces:
+        pieces.append(data)
+    return [piece.decode('utf-8') for piece in pieces]
+
+
+def first_line(text):
+    "text up to its first cr or lf, which would end the line early"
+    return NEWLINES_RE.split(text, 1)[0]
+
+
+def encode_line(line):
+    "a line as sent, cut to the length limit on a character boundary"
+    line = line.encode('utf-8', 'replace')
+    return line[:utf8_cut(line, MAX_LINE_BYTES)] + b'\r\n'
+
+
+def test_split_utf8():
+    assert split_utf8('short', 10) == ['short']
+    assert split_utf8('aaaa bbbb cccc', 10) == ['aaaa bbbb', 'cccc']
+    assert split_utf8('x' * 25, 10) == ['x' * 10, 'x' * 10, 'x' * 5]
+    text = u'\u00e9\u4e2d' * 10  # 2 and 3 byte characters
+    pieces = split_utf8(text, 8)
+    assert ''.join(pieces) == text
+    assert all(len(piece.encode('utf-8')) <= 8 for piece in pieces)
+    assert split_utf8(u'\U0001F600' * 3, 3) == [u'\U0001F600'] * 3
+
+
+def test_encode_line():
+    assert first_line('') == ''
+    assert first_line('a\x0bb\x0cc\x1cd\x85e\u2028f') == \
+        'a\x0bb\x0cc\x1cd\x85e\u2028f'  # not line breaks on irc
+    assert first_line('one\r\ntwo') == 'one'
+    assert encode_line('') == b'\r\n'
+    assert encode_line(u'\xe9' * 300) == u'\xe9'.encode('utf-8') * 255 + \
+        b'\r\n'
+
+
+class Censor(object):
+
+    "Replaces censored strings, finding them all in one pass (Aho-Corasick)"
+
+    def __init__(self, censored_strings=None):
+        self.strings = [s for s in censored_strings or [] if s]
+
+        # trie of the strings: goto[state][char] -> state
+        self.goto = [{}]
+        self.output = [[]]  # state -> indexes of the strings ending there
+        for index, string in enumerate(self.strings):
+            state = 0
+            for char in string:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(index)
+
+        # fail[state]: the state for the longest proper suffix in the trie
+        self.fail = [0] * len(self.goto)
+        pending = collections.deque(self.goto[0].values())  # breadth first
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.goto[state].items():
+                pending.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def matches(self, text):
+        "yields (start, index) for every occurrence of a censored string"
+        goto, fail, output, strings = self.goto, self.fail, self.output, \
+            self.strings
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield end - len(strings[index]), index
+
+    def __call__(self, text):
+        text = NEWLINES_RE.sub(' ', text)
+        if not self.strings:
+            return text
+
+        # the leftmost match wins, then the earliest string in the list,
+        # just like a regex alternation of the strings
+        out = []
+        last_end = 0
+        for start, index in sorted(self.matches(text)):
+            if start >= last_end:
+                out.append(text[last_end:start])
+                out.append('[censored]')
+                last_end = start + len(self.strings[index])
+        out.append(text[last_end:])
+        return ''.join(out)
+
+
+def test_censor():
+    def regex_censor(text, strings):  # how censoring used to work
+        if not strings:
+            return NEWLINES_RE.sub(' ', text)
+        pattern = '(%s)' % '|'.join(map(re.escape, strings))
+        return re.sub(pattern, '[censored]', NEWLINES_RE.sub(' ', text))
+
+    cases = [(['badword'], 'say badword here\r\nbadwords'),
+             (['ab', 'abc', 'bc'], 'abcabc xbc'),
+             (['abc', 'ab'], 'abcab'),
+             (['he', 'she', 'his', 'hers'], 'ushers and his hershe'),
+             (['a', 'aa', 'aaa'], 'aaaaa'),
+             (['b.c', '*'], 'ab.c ** abc'),
+             ([], 'nothing\nhere')]
+    for strings, text in cases:
+        assert Censor(strings)(text) == regex_censor(text, strings), strings
+
+
+class LineFramer(object):
+
+    "Splits received bytes into lines ending with crlf"
+
+    def __init__(self, size=4096):
+        self.buffer = bytearray()  # received bytes not yet split into lines
+        self.scanned = 0  # how much of buffer is known to have no crlf
+        self.chunk = memoryview(bytearray(size))  # recv_into target
+
+    def fill(self, recv_into):
+        "receives once with recv_into(buffer), returning the bytes read"
+        nbytes = recv_into(self.chunk)
+        self.buffer += self.chunk[:nbytes]
+        return nbytes
+
+    def lines(self):
+        "takes every complete line out of the buffer, in one pass"
+        buffer = self.buffer
+        lines = []
+        start = 0
+        end = buffer.find(b'\r\n', self.scanned)
+        while end >= 0:
+            lines.append(buffer[start:end])
+            start = end + 2
+            end = buffer.find(b'\r\n', start)
+        if start:
+            del buffer[:start]
+        self.scanned = max(len(buffer) - 1, 0)  # a crlf may be split
+        return lines
+
+
+def test_line_framer():
+    def receiver(*chunks):
+        chunks = list(chunks)
+
+        def recv_into(buffer):
+            chunk = chunks.pop(0)
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+        return recv_into
+
+    framer = LineFramer(16)
+    recv_into = receiver(b'PING :a\r\nPING', b' :b\r', b'\n', b'x' * 16,
+                         b'\r\n\r\n')
+    assert framer.fill(recv_into) == 13
+    assert framer.lines() == [b'PING :a']
+    framer.fill(recv_into)
+    assert framer.lines() == []
+    framer.fill(recv_into)
+    assert framer.lines() == [b'PING :b']
+    framer.fill(recv_into)
+    framer.fill(recv_into)
+    assert framer.lines() == [b'x' * 16, b'']
+    assert framer.buffer == b''
+
+
+class LineQueue(queue.Queue):
+
+    "Queue that sets an event whenever an item is put in it"
+
+    def __init__(self, ready):
+        queue.Queue.__init__(self)
+        self.ready = ready
+
+    def _put(self, item):
+        queue.Queue._put(self, item)
+        self.ready.set()
 
 
 class crlf_tcp(object):
@@ -45,15 +380,25 @@ class crlf_tcp(object):
     "Handles tcp connections that consist of utf-8 lines ending with crlf"
 
     def __init__(self, host, port, timeout=300):
-        self.ibuffer = b''
-        self.obuffer = b''
-        self.oqueue = queue.Queue()  # lines to be sent out
-        self.iqueue = queue.Queue()  # lines that were received
+        self.framer = LineFramer()
+        self.oqueue = LaneQueue()  # (time queued, line) to be sent out
+        self.iqueue = queue.Queue()  # lists of lines that were received
         self.socket = self.create_socket()
         self.host = host
         self.port = port
         self.timeout = timeout
 
+        # token bucket, in lines, that keeps us under the server's flood limit
+        self.flood_burst = DEFAULT_FLOOD_BURST
+        self.flood_rate = DEFAULT_FLOOD_RATE
+        self.tokens = DEFAULT_FLOOD_BURST
+        self.stamp = time.time()
+
+        self.sent_lines = 0
+        self.sent_bytes = 0
+        self.writes = 0
+        self.queue_latency = PluginStats()  # time lines spend in oqueue
+
     def create_socket(self):
         return socket.socket(socket.AF_INET, socket.TCP_NODELAY)
 
@@ -62,15 +407,16 @@ class crlf_tcp(object):
             try:
                 self.socket.connect((self.host, self.port))
             except socket.timeout:
-                print('timed out connecting to %s:%s' % (self.host, self.port))
+                bot.logger.warning('irc', 'timed out connecting to %s:%s' % (
+                    self.host, self.port))
                 time.sleep(60)
             else:
                 break
         _thread.start_new_thread(self.recv_loop, ())
         _thread.start_new_thread(self.send_loop, ())
 
-    def recv_from_socket(self, nbytes):
-        return self.socket.recv(nbytes)
+    def recv_into_socket(self, buffer):
+        return self.socket.recv_into(buffer)
 
     def get_timeout_exception_type(self):
         return socket.timeout
@@ -86,9 +432,7 @@ class crlf_tcp(object):
         last_timestamp = time.time()
         while True:
             try:
-                data = self.recv_from_socket(4096)
-                self.ibuffer += data
-                if data:
+                if self.framer.fill(self.recv_into_socket):
                     last_timestamp = time.time()
                 else:
                     if time.time() - last_timestamp > self.timeout:
@@ -101,18 +445,64 @@ class crlf_tcp(object):
                     return
                 continue
 
-            while b'\r\n' in self.ibuffer:
-                line, self.ibuffer = self.ibuffer.split(b'\r\n', 1)
-                self.iqueue.put(decode(line))
+            lines = self.framer.lines()
+            if lines:
+                self.iqueue.put([decode(line) for line in lines])
+
+    def set_flood_control(self, burst, rate):
+        "allows bursts of burst lines, then rate lines a second (0: no limit)"
+        self.flood_burst = burst
+        self.flood_rate = rate
+        self.tokens = min(self.tokens, burst)
+
+    def take_tokens(self, wanted):
+        "waits until a line can be sent, then takes tokens for up to wanted"
+        if not self.flood_rate:
+            return min(wanted, MAX_WRITE_LINES)
+        while True:
+            now = time.time()
+            self.tokens = min(self.flood_burst, self.tokens +
+                              (now - self.stamp) * self.flood_rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                taken = min(wanted, int(self.tokens))
+                self.tokens -= taken
+                return taken
+            time.sleep((1 - self.tokens) / self.flood_rate)
 
     def send_loop(self):
         while True:
-            line = self.oqueue.get().splitlines()[0][:500]
-            print(">>> %s" % line)
-            self.obuffer += line.encode('utf-8', 'replace') + b'\r\n'
-            while self.obuffer:
-                sent = self.socket.send(self.obuffer)
-                self.obuffer = self.obuffer[sent:]
+            lines = [self.oqueue.get()]
+            allowed = self.take_tokens(self.oqueue.qsize() + 1)
+            while len(lines) < allowed:  # join what else is queued
+                try:
+                    lines.append(self.oqueue.get_nowait())
+                except queue.Empty:
+                    self.tokens += allowed - len(lines)
+                    break
+
+            now = time.time()
+            data = bytearray()
+            for queued, line in lines:
+                line = first_line(line)
+                bot.logger.info('send', ">>> %s" % line, server=self.host)
+                data += encode_line(line)
+                self.queue_latency.record(now - queued, False)
+            self.socket.sendall(data)
+
+            self.sent_lines += len(lines)
+            self.sent_bytes += len(data)
+            self.writes += 1
+
+    def send_stats(self):
+        stats = self.queue_latency.to_dict()
+        return {'lines': self.sent_lines,
+                'bytes': self.sent_bytes,
+                'writes': self.writes,
+                'queued': self.oqueue.qsize(),
+                'latency_p50': stats['p50'],
+                'latency_p95': stats['p95'],
+                'latency_max': stats['max_time']}
 
 
 class crlf_ssl_tcp(crlf_tcp):
@@ -128,9 +518,6 @@ class crlf_ssl_tcp(crlf_tcp):
                            cert_reqs=CERT_NONE if self.ignore_cert_errors else
                            CERT_REQUIRED)
 
-    def recv_from_socket(self, nbytes):
-        return self.socket.read(nbytes)
-
     def get_timeout_exception_type(self):
         return SSLError
 
@@ -159,10 +546,6 @@ def test_zip_channels():
     assert zip_channels(['#a', '#b']) == ['#a,#b']
 
 class IRC(object):
-    IRC_PREFIX_REM = re.compile(r'(.*?) (.*?) (.*)').match
-    IRC_NOPROFEIX_REM = re.compile(r'()(.*?) (.*)').match
-    IRC_NETMASK_REM = re.compile(r':?([^!@]*)!?([^@]*)@?(.*)').match
-    IRC_PARAM_REF = re.compile(r'(?:^|(?<= ))(:.*|[^ ]+)').findall
 
     "handles the IRC protocol"
     # see the docs/ folder for more information on the protocol
@@ -174,6 +557,7 @@ class IRC(object):
         self.user = DEFAULT_NAME
         self.realname = DEFAULT_REALNAME
         self.user_mode = None
+        self.hostmask = None  # nick!user@host, as others see our messages
 
         self.server_host = None
         self.server_port = 6667
@@ -186,8 +570,10 @@ class IRC(object):
         self.channels = []
         self.admins = []
         self.censored_strings = []
+        self.shedding = False  # skipping optional work while input backs up
 
-        self.out = queue.Queue()  # responses from the server are placed here
+        # responses from the server are placed here
+        self.out = LineQueue(bot.input_ready)
         # format: [rawline, prefix, command, params,
         # nick, user, host, paramlist, msg]
 
@@ -214,8 +600,13 @@ class IRC(object):
         self.channels = conf.get('channels', [])
         self.admins = conf.get('admins', [])
         self.censored_strings = conf.get('censored_strings', [])
+        self.censor = Censor(self.censored_strings)
+
+        self.flood_burst = conf.get('flood_burst', DEFAULT_FLOOD_BURST)
+        self.flood_rate = conf.get('flood_rate', DEFAULT_FLOOD_RATE)
 
         if self.conn is not None:
+            self.conn.set_flood_control(self.flood_burst, self.flood_rate)
             self.join_channels()
 
     def create_connection(self):
@@ -223,36 +614,34 @@ class IRC(object):
 
     def connect(self):
         self.conn = self.create_connection()
+        self.conn.set_flood_control(self.flood_burst, self.flood_rate)
         _thread.start_new_thread(self.conn.run, ())
-        self.cmd("NICK", [self.nick])
-        self.cmd("USER", [self.user, "3", "*", self.realname])
+        self.cmd("NICK", [self.nick], 'protocol')
+        self.cmd("USER", [self.user, "3", "*", self.realname], 'protocol')
         if self.server_password:
-            self.cmd("PASS", [self.server_password])
+            self.cmd("PASS", [self.server_password], 'protocol')
+
+    def parse(self, line):
+        "splits a line from the server into the Message Input is built from"
+        return Message(line)
 
     def parse_loop(self):
         while True:
-            msg = self.conn.iqueue.get()
+            lines = self.conn.iqueue.get()
 
-            if msg == StopIteration:
+            if lines == StopIteration:
                 self.connect()
                 continue
 
-            if msg.startswith(":"):  # has a prefix
-                prefix, command, params = self.IRC_PREFIX_REM(msg).groups()
-            else:
-                prefix, command, params = self.IRC_NOPROFEIX_REM(msg).groups()
-            nick, user, host = self.IRC_NETMASK_REM(prefix).groups()
-            paramlist = self.IRC_PARAM_REF(params)
-            lastparam = ""
-            if paramlist:
-                if paramlist[-1].startswith(':'):
-                    paramlist[-1] = paramlist[-1][1:]
-                lastparam = paramlist[-1]
-            self.out.put([msg, prefix, command, params, nick, user, host,
-                          paramlist, lastparam])
-
-            if command == "PING":
-                self.cmd("PONG", paramlist)
+            for line in lines:
+                msg = self.parse(line)
+                self.out.put(msg)
+
+                if msg.nick == self.nick and msg.host:  # something we did
+                    self.hostmask = msg.prefix[1:]
+
+                if msg.command == "PING":
+                    self.cmd("PONG", list(msg.paraml), 'protocol')
 
     def join(self, channel):
         self.cmd("JOIN", channel.split(" "))  # [chan, password]
@@ -260,60 +649,98 @@ class IRC(object):
     def join_channels(self):
         if self.channels:
             # TODO: send multiple join commands for large channel lists
-            self.cmd("JOIN", zip_channels(self.channels))
+            self.cmd("JOIN", zip_channels(self.channels), 'protocol')
 
-    def msg(self, target, text):
-        self.cmd("PRIVMSG", [target, text])
+    def msg(self, target, text, lane='normal'):
+        self.cmd("PRIVMSG", [target, text], lane)
 
-    def cmd(self, command, params=None):
-        if params:
-            params[-1] = ':' + params[-1]
+    def prefix_len(self):
+        "bytes the server adds to the front of a line when it relays ours"
+        hostmask = self.hostmask or '%s!%s@%s' % (
+            self.nick, 'x' * MAX_USER_LEN, 'x' * MAX_HOST_LEN)
+        return len((':%s ' % hostmask).encode('utf-8'))
 
-            params = [censor(p, self.censored_strings) for p in params]
+    def max_message_len(self, target, command='PRIVMSG'):
+        "the most bytes of text that fit in one message to target"
+        return MAX_LINE_BYTES - self.prefix_len() - \
+            len(('%s %s :' % (command, target)).encode('utf-8'))
 
-            self.send(command + ' ' + ' '.join(params))
+    def cmd(self, command, params=None, lane='normal'):
+        # lane is 'protocol', 'admin' or 'normal': earlier lanes are sent first
+        if params:
+            params = [self.censor(p) for p in params]
+
+            start = ' '.join([command] + params[:-1]) + ' :'
+            room = MAX_LINE_BYTES - self.prefix_len() - \
+                len(start.encode('utf-8'))
+            text = params[-1]
+
+            ctcp = len(text) > 1 and text[0] == text[-1] == '\x01'
+            if ctcp:  # keep each piece a complete ctcp message
+                text = text[1:-1]
+                room -= 2
+
+            pieces = split_utf8(text, max(room, 1))
+            if command not in SPLITTABLE_COMMANDS:
+                pieces = pieces[:1]
+            for piece in pieces:
+                if ctcp:
+                    piece = '\x01%s\x01' % piece
+                self.send(start + piece, lane)
         else:
-            self.send(command)
+            self.send(command, lane)
 
-    def send(self, str):
-        self.conn.oqueue.put(str)
+    def send(self, str, lane='normal'):
+        self.conn.oqueue.put((lane, (time.time(), str)))
 
 
 class FakeIRC(IRC):
+
+    "stands in for a server connection when replaying recorded traffic"
+
     def __init__(self, conf):
+        self.conn = None
+        self.shedding = False
+        self.hostmask = None
         self.set_conf(conf)
-        self.out = queue.Queue()  # responses from the server are placed here
 
-        self.f = open(fn, 'rb')
+        # responses from the server are placed here
+        self.out = LineQueue(bot.input_ready)
 
-        _thread.start_new_thread(self.parse_loop, ())
+        self.sent = collections.Counter()  # command -> lines sent
 
-    def parse_loop(self):
-        while True:
-            msg = decode(self.f.readline()[9:])
+    def send(self, str, lane='normal'):
+        self.sent[str.split(' ', 1)[0]] += 1
 
-            if msg == '':
-                print("!!!!DONE READING FILE!!!!")
-                return
 
-            if msg.startswith(":"):  # has a prefix
-                prefix, command, params = irc_prefix_rem(msg).groups()
-            else:
-                prefix, command, params = irc_noprefix_rem(msg).groups()
-            nick, user, host = irc_netmask_rem(prefix).groups()
-            paramlist = irc_param_ref(params)
-            lastparam = ""
-            if paramlist:
-                if paramlist[-1].startswith(':'):
-                    paramlist[-1] = paramlist[-1][1:]
-                lastparam = paramlist[-1]
-            self.out.put([msg, prefix, command, params, nick, user, host,
-                          paramlist, lastparam])
-            if command == "PING":
-                self.cmd("PONG", [params])
-
-    def cmd(self, command, params=None):
-        pass
+def test_cmd_split():
+    class Recorder(IRC):
+        def __init__(self):
+            self.nick = 'skybot'
+            self.hostmask = 'skybot!bot@example.com'
+            self.censor = Censor([])
+            self.lines = []
+
+        def send(self, line, lane='normal'):
+            self.lines.append(line)
+
+    conn = Recorder()
+    room = conn.max_message_len('#test')
+    conn.msg('#test', 'word ' * 200)
+    assert len(conn.lines) == 3
+    assert all(len(line.encode('utf-8')) - len('PRIVMSG #test :') <= room
+               for line in conn.lines)
+    assert ' '.join(line.split(' :', 1)[1] for line in conn.lines) == \
+        'word ' * 200
+
+    conn.lines = []
+    conn.msg('#test', '\x01ACTION %s\x01' % (u'\u00e9' * 300))
+    assert len(conn.lines) == 2
+    assert all(line.endswith('\x01') for line in conn.lines)
+
+    conn.lines = []
+    conn.cmd('TOPIC', ['#test', 'x' * 600])
+    assert len(conn.lines) == 1
 
 
 class SSLIRC(IRC):
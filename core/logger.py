@@ -0,0 +1,105 @@
+import json
+import random
+import sys
+import time
+import traceback
+import _thread
+from queue import Queue, Full
+
+
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_QUEUE_SIZE = 10000  # records waiting for the writer before new ones drop
+
+
+class Logger(object):
+
+    '''Queues log records for one writer thread, so logging never blocks'''
+
+    def __init__(self, stream=None):
+        self.records = Queue(LOG_QUEUE_SIZE)
+        self.stream = stream or sys.stdout
+        self.level = LOG_LEVELS['info']
+        self.sample = {}  # category -> fraction of its records to keep
+        self.json = False
+        self.dropped = 0  # because the queue was full
+        self.sampled = 0  # skipped by sampling
+
+    def configure(self, config):
+        self.level = LOG_LEVELS.get(config.get('log_level', 'info'), 20)
+        self.sample = config.get('log_sample', {})
+        self.json = config.get('log_format', 'text') == 'json'
+
+    def log(self, level, category, message, **fields):
+        if LOG_LEVELS[level] < self.level:
+            return
+        rate = self.sample.get(category)
+        if rate is not None and random.random() >= rate:
+            self.sampled += 1
+            return
+        try:
+            self.records.put_nowait((time.time(), level, category, message,
+                                     fields))
+        except Full:
+            self.dropped += 1
+
+    def debug(self, category, message, **fields):
+        self.log('debug', category, message, **fields)
+
+    def info(self, category, message, **fields):
+        self.log('info', category, message, **fields)
+
+    def warning(self, category, message, **fields):
+        self.log('warning', category, message, **fields)
+
+    def error(self, category, message, **fields):
+        self.log('error', category, message, **fields)
+
+    def exception(self, category, message=None, **fields):
+        "logs the exception being handled, with its traceback"
+        text = traceback.format_exc().rstrip('\n')
+        if message:
+            text = message + '\n' + text
+        self.log('error', category, text, **fields)
+
+    def format(self, record):
+        stamp, level, category, message, fields = record
+        if not self.json:
+            return message
+        fields.update(time=stamp, level=level, category=category,
+                      message=message)
+        return json.dumps(fields, sort_keys=True, default=str)
+
+    def write(self):
+        while True:
+            record = self.records.get()
+            try:
+                self.stream.write(self.format(record) + '\n')
+                if self.records.empty():
+                    self.stream.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+def test_logger():
+    import io
+
+    logger = Logger(io.StringIO())
+    logger.configure({'log_level': 'info', 'log_sample': {'noisy': 0}})
+    logger.debug('core', 'hidden')
+    logger.info('noisy', 'sampled away')
+    logger.warning('core', 'shown', server='irc.example.com')
+    assert logger.records.qsize() == 1
+    assert logger.sampled == 1
+    assert logger.format(logger.records.get()) == 'shown'
+
+    logger.json = True
+    logger.error('core', 'broken', chan='#test')
+    record = json.loads(logger.format(logger.records.get()))
+    assert record['level'] == 'error'
+    assert record['message'] == 'broken'
+    assert record['chan'] == '#test'
+
+
+if not hasattr(bot, 'logger'):
+    bot.logger = Logger()
+    _thread.start_new_thread(bot.logger.write, ())
@@ -2,91 +2,173 @@ from __future__ import print_function
 from builtins import str
 from builtins import range
 from builtins import object
+from builtins import chr
+import collections
 import re
+import threading
+import time
 import _thread
-import traceback
 from queue import Queue
 from future.builtins import str
 
+try:
+    from re import _parser as sre_parse  # python 3.11+
+except ImportError:
+    import sre_parse
+
 _thread.stack_size(1024 * 512)  # reduce vm size
 
+# queued work is served a lane at a time, in this order
+LANES = ('protocol', 'admin', 'normal')
+
+
+class LaneQueue(Queue):
+
+    "Queue of (lane, item) pairs that serves earlier lanes first"
+
+    def _init(self, maxsize):
+        self.lanes = dict((lane, collections.deque()) for lane in LANES)
+
+    def _qsize(self):
+        return sum(len(items) for items in self.lanes.values())
+
+    def _put(self, item):
+        lane, item = item
+        self.lanes[lane].append(item)
+
+    def _get(self):
+        for lane in LANES:
+            if self.lanes[lane]:
+                return self.lanes[lane].popleft()
+
+    def lane_size(self, lane):
+        return len(self.lanes[lane])
+
+
+def test_lane_queue():
+    q = LaneQueue()
+    for lane, item in [('normal', 1), ('admin', 2), ('normal', 3),
+                       ('protocol', 4), ('admin', 5)]:
+        q.put((lane, item))
+    assert q.qsize() == 5
+    assert q.lane_size('normal') == 2
+    assert [q.get() for i in range(5)] == [4, 2, 5, 1, 3]
 
-class Input(dict):
 
-    def __init__(self, conn, raw, prefix, command, params,
-                 nick, user, host, paraml, msg):
+class Input(object):
 
-        server = conn.server_host
+    '''The line a plugin is handling, and helpers to respond to it'''
 
-        chan = paraml[0].lower()
+    __slots__ = ('conn', 'message', 'raw', 'prefix', 'command', 'params',
+                 'nick', 'user', 'host', 'paraml', 'msg', 'server', 'chan',
+                 'lastparam', 'inp', 'inp_unstripped', 'trigger', 'db',
+                 'api_key', 'admin', 'cache_key', 'lane')
+
+    helpers = ('say', 'reply', 'pm', 'set_nick', 'me', 'notice', 'kick', 'ban',
+               'unban', 'bot', 'tags')
+
+    def __init__(self, conn, message):
+        self.conn = conn
+        self.message = message  # the parsed line, shared by every Input
+        self.raw = message.raw
+        self.prefix = message.prefix
+        self.command = message.command
+        self.params = message.params
+        self.nick = message.nick
+        self.user = message.user
+        self.host = message.host
+        self.paraml = message.paraml
+        self.msg = message.lastparam
+        self.server = conn.server_host
+
+        chan = message.paraml[0].lower() if message.paraml else ''
         if chan == conn.nick.lower():  # is a PM
-            chan = nick
+            chan = message.nick
+        self.chan = chan
 
-        def say(msg):
-            conn.msg(chan, msg)
+        self.lastparam = message.lastparam
+        self.inp = message.paraml
+        self.lane = 'normal'  # where replies are queued
 
-        def reply(msg):
-            if chan == nick:  # PMs don't need prefixes
-                self.say(msg)
-            else:
-                self.say(nick + ': ' + msg)
+    @property
+    def bot(self):
+        return bot
 
-        def pm(msg, nick=nick):
-            conn.msg(nick, msg)
+    @property
+    def tags(self):
+        return self.message.tags
 
-        def set_nick(nick):
-            conn.set_nick(nick)
+    def say(self, msg):
+        self.conn.msg(self.chan, msg, self.lane)
 
-        def me(msg):
-            self.say("\x01%s %s\x01" % ("ACTION", msg))
+    def reply(self, msg):
+        if self.chan == self.nick:  # PMs don't need prefixes
+            self.say(msg)
+        else:
+            self.say(self.nick + ': ' + msg)
+
+    def pm(self, msg, nick=None):
+        self.conn.msg(nick or self.nick, msg, self.lane)
 
-        def notice(msg):
-            conn.cmd('NOTICE', [nick, msg])
+    def set_nick(self, nick):
+        self.conn.set_nick(nick)
 
-        def kick(target=None, reason=None):
-            conn.cmd('KICK', [chan, target or nick, reason or ''])
+    def me(self, msg):
+        self.say("\x01%s %s\x01" % ("ACTION", msg))
 
-        def ban(target=None):
-            conn.cmd('MODE', [chan, '+b', target or host])
+    def notice(self, msg):
+        self.conn.cmd('NOTICE', [self.nick, msg], self.lane)
 
-        def unban(target=None):
-            conn.cmd('MODE', [chan, '-b', target or host])
+    def kick(self, target=None, reason=None):
+        self.conn.cmd('KICK', [self.chan, target or self.nick, reason or ''],
+                      self.lane)
 
+    def ban(self, target=None):
+        self.conn.cmd('MODE', [self.chan, '+b', target or self.host],
+                      self.lane)
 
-        dict.__init__(self, conn=conn, raw=raw, prefix=prefix, command=command,
-                      params=params, nick=nick, user=user, host=host,
-                      paraml=paraml, msg=msg, server=server, chan=chan,
-                      notice=notice, say=say, reply=reply, pm=pm, bot=bot,
-                      kick=kick, ban=ban, unban=unban, me=me,
-                      set_nick=set_nick, lastparam=paraml[-1])
+    def unban(self, target=None):
+        self.conn.cmd('MODE', [self.chan, '-b', target or self.host],
+                      self.lane)
 
-    # make dict keys accessible as attributes
-    def __getattr__(self, key):
-        return self[key]
+    # read-only mapping interface, for dict(input) and **input
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)] + \
+            list(self.helpers)
 
-    def __setattr__(self, key, value):
-        self[key] = value
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
 
+    def __contains__(self, key):
+        return hasattr(self, key)
 
-def run(func, input):
-    args = func._args
 
-    if 'inp' not in input:
-        input.inp = input.paraml
+def run(func, input, owner=None):
+    if 'db' in func._args and 'db' not in input:
+        input.db = get_db_connection(input.conn)
 
-    if args:
-        if 'db' in args and 'db' not in input:
-            input.db = get_db_connection(input.conn)
-        if 'input' in args:
-            input.input = input
-        if 0 in args:
-            out = func(input.inp, **input)
+    call = start_call(func, input, owner)
+    try:
+        if func._cpu_bound:
+            out = call_cpu_bound(func, input)
         else:
-            kw = dict((key, input[key]) for key in args if key in input)
-            out = func(input.inp, **kw)
-    else:
-        out = func(input.inp)
-    if out is not None:
+            out = func._call(input)
+    except:
+        bot.metrics.record(func, time.time() - call.started, error=True)
+        if 'cache_key' in input and not call.timed_out:  # already failed
+            bot.result_cache.fail(input.cache_key)
+        raise
+    finally:
+        end_call(call)
+    bot.metrics.record(func, time.time() - call.started)
+
+    if 'cache_key' in input:
+        bot.result_cache.store(input.cache_key, out)
+
+    if out is not None and not call.timed_out:
         input.reply(str(out))
 
 
@@ -94,8 +176,7 @@ def do_sieve(sieve, bot, input, func, type, args):
     try:
         return sieve(bot, input, func, type, args)
     except Exception:
-        print('sieve error', end=' ')
-        traceback.print_exc()
+        bot.logger.exception('core', 'sieve error')
         return None
 
 
@@ -106,6 +187,7 @@ class Handler(object):
     def __init__(self, func):
         self.func = func
         self.input_queue = Queue()
+        self.abandoned = set()  # threads left running a timed out call
         _thread.start_new_thread(self.start, ())
 
     def start(self):
@@ -125,9 +207,13 @@ class Handler(object):
                 input.db = db
 
             try:
-                run(self.func, input)
+                run(self.func, input, self)
             except:
-                traceback.print_exc()
+                bot.logger.exception('plugin', plugin=plugin_name(self.func))
+
+            if _thread.get_ident() in self.abandoned:
+                self.abandoned.discard(_thread.get_ident())
+                break
 
     def stop(self):
         self.input_queue.put(StopIteration)
@@ -135,13 +221,138 @@ class Handler(object):
     def put(self, value):
         self.input_queue.put(value)
 
+    def depth(self):
+        return self.input_queue.qsize()
+
+    def abandon(self, thread):
+        "lets a stuck thread finish on its own while a new one takes over"
+        self.abandoned.add(thread)
+        _thread.start_new_thread(self.start, ())
+
+
+class WorkerPool(object):
+
+    '''Runs plugins on a bounded set of threads, rejecting excess work'''
+
+    def __init__(self):
+        self.jobs = LaneQueue()
+        self.queue_size = 0
+        self.lock = _thread.allocate_lock()
+        self.freed = threading.Condition(self.lock)  # room opened up
+        self.size = 0
+        self.plugin_limit = None
+        self.in_flight = {}  # func -> number of queued or running calls
+        self.abandoned = set()  # threads left running a timed out call
+        self.dropped = 0
+        self.blocking = False  # wait for room instead of dropping calls
+        self.waited = 0  # seconds blocking submits spent waiting for room
+
+    def configure(self, size, queue_size, plugin_limit):
+        self.queue_size = queue_size
+        self.plugin_limit = plugin_limit
+        with self.lock:
+            while self.size > size:  # one stop per surplus thread
+                self.size -= 1
+                self.jobs.put(('protocol', StopIteration))
+            while self.size < size:
+                self.size += 1
+                _thread.start_new_thread(self.work, ())
+
+    def depth(self):
+        return self.jobs.qsize()
+
+    def abandon(self, thread):
+        "lets a stuck thread finish on its own while a new one takes over"
+        with self.lock:
+            self.abandoned.add(thread)
+            _thread.start_new_thread(self.work, ())
+
+    def submit(self, func, input):
+        "queues a call to func, returning False if it was rejected"
+        limit = getattr(func, '_concurrency', None) or self.plugin_limit
+        with self.lock:
+            while True:
+                pending = self.in_flight.get(func, 0)
+                queued = self.jobs.lane_size('normal')
+                full = (limit and pending >= limit) or \
+                    (self.queue_size and queued >= self.queue_size)
+                if not full or input.lane != 'normal':  # others always go
+                    self.jobs.put((input.lane, (func, input)))
+                    self.in_flight[func] = pending + 1
+                    return True
+                if not self.blocking:
+                    self.dropped += 1
+                    return False
+                start = time.time()
+                self.freed.wait()
+                self.waited += time.time() - start
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+
+            if job == StopIteration:
+                return
+
+            func, input = job
+            if self.blocking:  # a queue slot opened
+                with self.lock:
+                    self.freed.notify_all()
+
+            try:
+                if isinstance(input, TaskInput):
+                    run_task(func, input, self)
+                else:
+                    run(func, input, self)
+            except:
+                bot.logger.exception('plugin', plugin=plugin_name(func))
+
+            with self.lock:
+                self.in_flight[func] -= 1
+                if not self.in_flight[func]:
+                    del self.in_flight[func]
+                self.freed.notify_all()
+                if _thread.get_ident() in self.abandoned:
+                    self.abandoned.discard(_thread.get_ident())
+                    return
+
+
+if not hasattr(bot, 'workers'):
+    bot.workers = WorkerPool()
+
+
+def shedding(conn):
+    "whether conn's unread input is backed up enough to skip optional work"
+    high = bot.config.get('shed_high_watermark', 200)
+    if not high:
+        return False
+    backlog = conn.out.qsize()
+    if not conn.shedding and backlog >= high:
+        conn.shedding = True
+        bot.logger.warning('core', '### shedding load: %d lines waiting from '
+                           '%s' % (backlog, conn.server_host))
+    elif conn.shedding and backlog <= bot.config.get('shed_low_watermark', 50):
+        conn.shedding = False
+        bot.logger.warning('core', '### stopped shedding load from %s' %
+                           conn.server_host)
+    return conn.shedding
+
 
 def dispatch(input, kind, func, args, autohelp=False):
+    # regexes (url previews and such) can be skipped under load by default,
+    # other hooks only if they say so
+    if args.get('shed', kind == 'regex') and shedding(input.conn):
+        bot.metrics.record_shed(func)
+        return
+
     for sieve, in bot.plugs['sieve']:
         input = do_sieve(sieve, bot, input, func, kind, args)
         if input == None:
             return
 
+    if args.get('adminonly') and 'admin' in input and input.admin:
+        input.lane = 'admin'  # admin commands jump the queues
+
     if autohelp and args.get('autohelp', True) and not input.inp \
             and func.__doc__ is not None:
         input.reply(func.__doc__)
@@ -162,27 +373,237 @@ def dispatch(input, kind, func, args, autohelp=False):
         else:
             input.api_key = keys
 
-    if func._thread:
-        bot.threads[func].put(input)
-    else:
-        _thread.start_new_thread(run, (func, input))
+    if hasattr(func, '_cached') and not bot.result_cache.fetch(func, input):
+        return  # answered from the cache, or waiting on an identical call
 
+    submit(func, input)
 
-def match_command(command):
-    commands = list(bot.commands)
 
-    # do some fuzzy matching
-    prefix = [x for x in commands if x.startswith(command)]
-    if len(prefix) == 1:
-        return prefix[0]
-    elif prefix and command not in prefix:
-        return prefix
+def submit(func, input):
+    "hands a call to the event loop, the plugin's thread or the workers"
+    if func._async:
+        if not submit_coroutine(func, input):
+            if 'cache_key' in input:
+                bot.result_cache.fail(input.cache_key)
+            bot.logger.warning('core', '### dropped %s call: too many are '
+                               'running' % func.__name__)
+    elif func._thread:
+        bot.threads[func].put(input)
+    elif not bot.workers.submit(func, input):
+        if 'cache_key' in input:
+            bot.result_cache.fail(input.cache_key)
+        bot.logger.warning('core', '### dropped %s call: %d calls queued for '
+                           'workers' % (func.__name__, bot.workers.depth()))
+
+
+class CommandIndex(object):
+
+    '''Prefix trie over the command names, plus cached trigger regexes'''
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.trie = {}  # char -> child node, None -> names sharing the prefix
+        for name in commands:
+            node = self.trie
+            for char in name:
+                node = node.setdefault(char, {})
+                node.setdefault(None, []).append(name)
+        self.command_res = {}
+
+    def match(self, command):
+        node = self.trie
+        for char in command:
+            node = node.get(char)
+            if node is None:
+                return command
+
+        # do some fuzzy matching
+        prefix = node[None]
+        if len(prefix) == 1:
+            return prefix[0]
+        elif command not in self.commands:
+            return prefix
+
+        return command
+
+    def command_re(self, bot_prefix, is_private, bot_nick):
+        if isinstance(bot_prefix, list):
+            key = (tuple(bot_prefix), is_private, bot_nick)
+        else:
+            key = (bot_prefix, is_private, bot_nick)
+        command_re = self.command_res.get(key)
+        if command_re is None:
+            command_re = make_command_re(bot_prefix, is_private, bot_nick)
+            self.command_res[key] = command_re
+        return command_re
+
+
+def test_command_index():
+    index = CommandIndex({'dice': None, 'dictionary': None, 'di': None,
+                          'weather': None})
+    assert index.match('w') == 'weather'
+    assert index.match('dict') == 'dictionary'
+    assert index.match('di') == 'di'
+    assert sorted(index.match('dic')) == ['dice', 'dictionary']
+    assert index.match('foo') == 'foo'
+    assert index.command_re('.', False, 'bot') is \
+        index.command_re('.', False, 'bot')
+    assert index.command_re(['.'], True, 'bot').match('foo')
+    assert not index.command_re(['.'], False, 'bot').match('foo')
+
+
+class EventIndex(object):
+
+    '''Event hooks by irc command and channel, skipping filtered ones'''
+
+    def __init__(self, plugs):
+        handlers = []  # (event, func, args, channels, networks)
+        for func, args in plugs:
+            channels = args.get('channels')
+            if channels is not None:
+                channels = frozenset(chan.lower() for chan in channels)
+            networks = args.get('networks')
+            if networks is not None:
+                networks = frozenset(networks)
+            for event in args['events']:
+                handlers.append((event, func, args, channels, networks))
+
+        self.events = set(h[0] for h in handlers) - set(['*'])
+        self.channels = set()
+        for h in handlers:
+            self.channels |= h[3] or set()
+        self.network_filtered = any(h[4] is not None for h in handlers)
+
+        self.index = {}
+        for event in list(self.events) + ['*']:
+            wanted = [event, '*'] if event != '*' else ['*']
+            for chan in list(self.channels) + [None]:
+                self.index[event, chan] = [
+                    (func, args, networks)
+                    for want in wanted
+                    for e, func, args, channels, networks in handlers
+                    if e == want and (channels is None or chan in channels)]
+
+    def lookup(self, command, chan, server):
+        "returns the (func, args) of the event hooks a line should go to"
+        if command not in self.events:
+            command = '*'
+        if chan not in self.channels:
+            chan = None
+        handlers = self.index[command, chan]
+        return [(func, args) for func, args, networks in handlers
+                if not self.network_filtered or networks is None or
+                server in networks]
+
+
+def test_event_index():
+    def plug(name, events, **kwargs):
+        return name, dict(kwargs, events=events)
+
+    index = EventIndex([plug('log', ['*']),
+                        plug('seen', ['PRIVMSG']),
+                        plug('greet', ['JOIN', 'PRIVMSG'], channels=['#A']),
+                        plug('local', ['*'], networks=['irc.local'])])
+
+    def lookup(command, chan, server='irc.example.com'):
+        return [func for func, args in index.lookup(command, chan, server)]
+
+    assert lookup('PRIVMSG', '#b') == ['seen', 'log']
+    assert lookup('PRIVMSG', '#a') == ['seen', 'greet', 'log']
+    assert lookup('JOIN', '#a') == ['greet', 'log']
+    assert lookup('JOIN', '#b') == ['log']
+    assert lookup('004', 'skybot') == ['log']
+    assert lookup('004', 'skybot', 'irc.local') == ['log', 'local']
+
+
+def required_literals(pattern, ignorecase=False):
+    "returns runs of literal text that every match of a parsed regex contains"
+    repeats = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+    literals = []
+    run = []
+    for op, av in pattern:
+        if op == sre_parse.LITERAL:
+            char = chr(av)
+            # a few letters case-insensitively match non-ascii characters
+            # (e.g. the kelvin sign), so they can't be checked with lower()
+            if not ignorecase or (av < 128 and char.lower() not in 'iks'):
+                run.append(char)
+                continue
+        if run:
+            literals.append(''.join(run))
+            run = []
+        if op == sre_parse.SUBPATTERN:
+            # (?i:...) in a case-sensitive regex: its literals would be checked
+            # case-sensitively, so leave them out. av is (group, add flags,
+            # del flags, pattern), or (group, pattern) before python 3.6
+            scoped = len(av) == 4 and av[1] & re.IGNORECASE
+            if ignorecase or not scoped:
+                literals.extend(required_literals(av[-1], ignorecase))
+        elif op in repeats and av[0] >= 1:
+            literals.extend(required_literals(av[2], ignorecase))
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def test_required_literals():
+    def literals(regex, flags=0):
+        return required_literals(sre_parse.parse(regex, flags),
+                                 bool(flags & re.IGNORECASE))
+
+    assert literals(r'vimeo.com/([0-9]+)') == ['vimeo', 'com/']
+    assert literals(r'^\? ?(\S+) ?(\d+)?') == ['?']
+    assert literals(r'(?:www\.)?tiny(url)\.com') == ['tiny', 'url', '.com']
+    assert literals(r'(ab)+c|d') == []
+    assert literals(r'.*') == []
+    assert literals(r'Youtube\.com', re.I) == ['Youtube.com']
+    assert literals(r'Kick\.com', re.I) == ['c', '.com']
+    assert literals(r'(?i:youtube)\.com') == ['.com']
+    assert literals(r'(?-i:You)tube', re.I) == ['You', 'tube']
+
+
+class RegexMatcher(object):
+
+    '''Searches the regex hooks, skipping those whose literals are absent'''
+
+    def __init__(self, plugs):
+        self.plugs = []
+        for func, args in plugs:
+            regex = args['re']
+            ignorecase = bool(regex.flags & re.IGNORECASE)
+            literals = required_literals(sre_parse.parse(regex.pattern,
+                                                         regex.flags),
+                                         ignorecase)
+            literal = max(literals, key=len) if literals else ''
+            if ignorecase:
+                literal = literal.lower()
+            self.plugs.append((literal, ignorecase, func, args))
+
+    def search(self, text):
+        lowered = None
+        for literal, ignorecase, func, args in self.plugs:
+            if literal:
+                if not ignorecase:
+                    if literal not in text:
+                        continue
+                else:
+                    if lowered is None:
+                        lowered = text.lower()
+                    if literal not in lowered:
+                        continue
+            m = args['re'].search(text)
+            if m:
+                yield func, args, m
+
 
-    return command
+def match_command(command):
+    return bot.command_index.match(command)
 
 def make_command_re(bot_prefix, is_private, bot_nick):
     if not isinstance(bot_prefix, list):
         bot_prefix = [bot_prefix]
+    else:
+        bot_prefix = list(bot_prefix)
     if is_private:
         bot_prefix.append('')  # empty prefix
     bot_prefix = '|'.join(re.escape(p) for p in bot_prefix)
@@ -202,18 +623,20 @@ def test_make_command_re():
     match = make_command_re(['.', '!'], False, 'bot').match
     assert match('!foo args').groups() == ('foo', 'args')
 
-def main(conn, out):
-    inp = Input(conn, *out)
+def main(conn, message):
+    inp = Input(conn, message)
 
     # EVENTS
-    for func, args in bot.events[inp.command] + bot.events['*']:
-        dispatch(Input(conn, *out), "event", func, args)
+    for func, args in bot.event_index.lookup(inp.command, inp.chan,
+                                             inp.server):
+        dispatch(Input(conn, message), "event", func, args)
 
     if inp.command == 'PRIVMSG':
         # COMMANDS
         config_prefix = bot.config.get("prefix", ".")
         is_private = inp.chan == inp.nick  # no prefix required
-        command_re = make_command_re(config_prefix, is_private, inp.conn.nick)
+        command_re = bot.command_index.command_re(config_prefix, is_private,
+                                                  inp.conn.nick)
 
         m = command_re.match(inp.lastparam)
 
@@ -222,11 +645,11 @@ def main(conn, out):
             command = match_command(trigger)
 
             if isinstance(command, list):  # multiple potential matches
-                input = Input(conn, *out)
+                input = Input(conn, message)
                 input.reply("did you mean %s or %s?" %
                             (', '.join(command[:-1]), command[-1]))
             elif command in bot.commands:
-                input = Input(conn, *out)
+                input = Input(conn, message)
                 input.trigger = trigger
                 input.inp_unstripped = m.group(2)
                 input.inp = input.inp_unstripped.strip()
@@ -235,10 +658,8 @@ def main(conn, out):
                 dispatch(input, "command", func, args, autohelp=True)
 
         # REGEXES
-        for func, args in bot.plugs['regex']:
-            m = args['re'].search(inp.lastparam)
-            if m:
-                input = Input(conn, *out)
-                input.inp = m
+        for func, args, m in bot.regex_matcher.search(inp.lastparam):
+            input = Input(conn, message)
+            input.inp = m
 
-                dispatch(input, "regex", func, args)
+            dispatch(input, "regex", func, args)
@@ -0,0 +1,125 @@
+from __future__ import division
+
+import bisect
+import json
+import os
+import time
+import _thread
+
+
+LATENCY_BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)  # seconds
+METRICS_FILENAME = 'metrics.json'
+
+
+def plugin_name(func):
+    filename = getattr(func, '_filename', func.__code__.co_filename)
+    module = os.path.splitext(os.path.basename(filename))[0]
+    return '%s.%s' % (module, func.__name__)
+
+
+class PluginStats(object):
+
+    "call counts and a latency histogram for one plugin function"
+
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # histogram[i] counts calls that took at most LATENCY_BUCKETS[i]
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, elapsed, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def percentile(self, fraction):
+        "returns an upper bound on the latency of the given fraction of calls"
+        needed = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if seen >= needed:
+                return bound
+        return self.max_time
+
+    def to_dict(self):
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'total_time': self.total_time,
+                'max_time': self.max_time,
+                'p50': self.percentile(.5),
+                'p95': self.percentile(.95),
+                'histogram': dict(zip([str(b) for b in LATENCY_BUCKETS] +
+                                      ['inf'], self.histogram))}
+
+
+class Metrics(object):
+
+    "per-plugin stats, shared by every thread that runs plugins"
+
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.plugins = {}  # plugin name -> PluginStats
+        self.shed = {}  # plugin name -> calls skipped to shed load
+        self.started = time.time()
+
+    def record(self, func, elapsed, error=False):
+        name = plugin_name(func)
+        with self.lock:
+            stats = self.plugins.get(name)
+            if stats is None:
+                stats = self.plugins[name] = PluginStats()
+            stats.record(elapsed, error)
+
+    def record_shed(self, func):
+        name = plugin_name(func)
+        with self.lock:
+            self.shed[name] = self.shed.get(name, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            plugins = dict((name, stats.to_dict())
+                           for name, stats in self.plugins.items())
+            for name, count in self.shed.items():
+                plugins.setdefault(name, {})['shed'] = count
+            shed = sum(self.shed.values())
+
+        for func, handler in list(bot.threads.items()):
+            stats = plugins.setdefault(plugin_name(func), {})
+            stats['queued'] = handler.input_queue.qsize()
+
+        return {'time': time.time(),
+                'uptime': time.time() - self.started,
+                'workers': {'threads': bot.workers.size,
+                            'queued': bot.workers.depth(),
+                            'dropped': bot.workers.dropped,
+                            'shed': shed},
+                'cache': bot.result_cache.stats(),
+                'connections': dict((name, conn.conn.send_stats())
+                                    for name, conn in bot.conns.items()
+                                    if conn.conn is not None),
+                'log': {'queued': bot.logger.records.qsize(),
+                        'dropped': bot.logger.dropped,
+                        'sampled': bot.logger.sampled},
+                'plugins': plugins}
+
+    def dump(self, filename):
+        snapshot = self.snapshot()
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(snapshot, f, sort_keys=True, indent=2)
+        os.rename(filename + '.tmp', filename)  # never leave a partial file
+
+
+def dump_metrics():
+    bot.metrics.dump(os.path.join(bot.persist_dir, METRICS_FILENAME))
+
+
+if not hasattr(bot, 'metrics'):
+    bot.metrics = Metrics()
@@ -0,0 +1,47 @@
+import multiprocessing
+
+from util import cpu
+
+
+# input attributes that can be sent to another process
+CPU_BOUND_ARGS = frozenset(['nick', 'user', 'host', 'chan', 'server', 'msg',
+                            'raw', 'trigger', 'command', 'params', 'paraml',
+                            'lastparam', 'api_key'])
+
+
+def pool_context():
+    """a start method that doesn't fork the bot: by now it has threads, and a
+    forked child could inherit one of their locks held"""
+    if not hasattr(multiprocessing, 'get_context'):  # python 2 only forks
+        return multiprocessing
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def start_cpu_pool(size):
+    if bot.cpu_pool is None:
+        bot.cpu_pool = pool_context().Pool(size, cpu.init_worker)
+
+
+def call_cpu_bound(func, input):
+    "runs a @hook.cpu_bound function in the process pool and waits for it"
+    if bot.cpu_pool is None:  # not configured yet
+        return func._call(input)
+
+    kw = dict((key, getattr(input, key)) for key in func._args
+              if key in CPU_BOUND_ARGS and key in input)
+
+    timeout = getattr(func, '_timeout', None)
+    if timeout is None:
+        timeout = bot.config.get('plugin_timeout', 60)
+
+    result = bot.cpu_pool.apply_async(cpu.call, (
+        func._filename, func.__name__, input.inp, kw,
+        bot.config.get('cpu_time_limit', 5),
+        bot.config.get('cpu_result_limit', 4096)))
+    return result.get(timeout or None)
+
+
+if not hasattr(bot, 'cpu_pool'):
+    bot.cpu_pool = None
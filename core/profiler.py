@@ -0,0 +1,99 @@
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import sys
+import time
+import _thread
+
+
+class Profiler(object):
+
+    "samples every thread's stack, counting identical stacks"
+
+    def __init__(self, seconds, rate):
+        self.seconds = seconds
+        self.interval = 1 / rate
+        self.stacks = collections.Counter()  # 'frame;frame;...' -> samples
+        self.samples = 0
+        self.names = {}  # code object -> frame name
+        for kind, plugs in bot.plugs.items():
+            for plug in plugs:
+                func = plug[0]
+                if hasattr(func, '__code__'):
+                    self.names[func.__code__] = '[%s %s]' % (
+                        kind, plugin_name(func))
+
+    def frame_name(self, code):
+        name = self.names.get(code)
+        if name is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = self.names[code] = '%s.%s' % (module, code.co_name)
+        return name
+
+    def sample(self):
+        me = _thread.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def run(self):
+        end = time.time() + self.seconds
+        while time.time() < end:
+            self.sample()
+            time.sleep(self.interval)
+
+    def plugins(self):
+        "samples spent inside each plugin function, most first"
+        counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            for name in set(stack.split(';')):
+                if name.startswith('['):
+                    counts[name[1:-1].split(' ')[1]] += count
+        return counts.most_common()
+
+    def write(self, filename):
+        "writes the stacks in the collapsed format flamegraph.pl reads"
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+
+def run_profile(profiler, done):
+    try:
+        profiler.run()
+        filename = os.path.join(bot.persist_dir, 'profile-%s.txt' %
+                                time.strftime('%Y%m%d-%H%M%S'))
+        profiler.write(filename)
+        bot.logger.info('core', '### wrote profile to %s' % filename)
+        if done is not None:
+            done(filename, profiler)
+    except Exception:
+        bot.logger.exception('core')
+    finally:
+        bot.profiler = None
+
+
+def start_profile(seconds, rate, done=None):
+    """samples stacks rate times a second for seconds, then writes them to
+    persist/ and calls done(filename, profiler). returns False if a profile is
+    already running"""
+    if bot.profiler is not None:
+        return False
+    bot.profiler = Profiler(seconds, rate)
+    _thread.start_new_thread(run_profile, (bot.profiler, done))
+    return True
+
+
+bot.start_profile = start_profile
+
+if not hasattr(bot, 'profiler'):
+    bot.profiler = None
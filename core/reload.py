@@ -92,7 +92,7 @@ def reload(init=False):
                 namespace = {}
                 eval(code, namespace)
             except Exception:
-                traceback.print_exc()
+                bot.logger.exception('core', 'error loading %s' % filename)
                 continue
 
             # remove plugins already loaded from this filename
@@ -114,28 +114,33 @@ def reload(init=False):
                         bot.plugs[type] += [data]
 
                         if not init:
-                            print('### new plugin (type: %s) loaded:' % \
-                                type, format_plug(data))
+                            bot.logger.info('core', '### new plugin (type: %s) '
+                                            'loaded: %s' % (type,
+                                                            format_plug(data)))
 
     if changed:
         bot.commands = {}
         for plug in bot.plugs['command']:
             name = plug[1]['name'].lower()
             if not re.match(r'^\w+$', name):
-                print('### ERROR: invalid command name "%s" (%s)' % (name,
-                                                                     format_plug(plug)))
+                bot.logger.error('core', '### ERROR: invalid command name "%s" '
+                                 '(%s)' % (name, format_plug(plug)))
                 continue
             if name in bot.commands:
-                print("### ERROR: command '%s' already registered (%s, %s)" % \
-                    (name, format_plug(bot.commands[name]),
-                     format_plug(plug)))
+                bot.logger.error('core', "### ERROR: command '%s' already "
+                                 "registered (%s, %s)" % (
+                                     name, format_plug(bot.commands[name]),
+                                     format_plug(plug)))
                 continue
             bot.commands[name] = plug
 
-        bot.events = collections.defaultdict(list)
-        for func, args in bot.plugs['event']:
-            for event in args['events']:
-                bot.events[event].append((func, args))
+        bot.command_index = CommandIndex(bot.commands)
+
+        bot.regex_matcher = RegexMatcher(bot.plugs['regex'])
+
+        bot.event_index = EventIndex(bot.plugs['event'])
+
+        bot.scheduler.set_periodic(bot.plugs['periodic'])
 
     if init:
         print('  plugin listing:')
@@ -0,0 +1,189 @@
+from __future__ import division, print_function
+
+import collections
+import json
+import os
+import re
+import time
+
+
+REPLAY_DIR = 'replay'  # under persist/, so replays don't touch the real dbs
+DRAIN_TIMEOUT = 60     # seconds to wait for queued plugin calls to finish
+
+TIMESTAMP_RE = re.compile(r'(\d\d):(\d\d):(\d\d) ')
+LOG_FILENAME_RE = re.compile(r'(.+)\.\d\d-\d\d\.log$')
+
+# the formats plugins/log.py writes, and the raw lines they came from
+LOG_FORMATS = [
+    (r'<(?P<nick>[^>]+)> (?P<msg>.*)',
+     ':%(nick)s!%(nick)s@replay PRIVMSG %(chan)s :%(msg)s'),
+    (r'\* (?P<nick>\S+) (?P<msg>.*)',
+     ':%(nick)s!%(nick)s@replay PRIVMSG %(chan)s :\x01ACTION %(msg)s\x01'),
+    (r'(?P<nick>\S+) \[(?P<user>[^@]*)@(?P<host>\S*)\] requested unknown '
+     r'CTCP (?P<ctcp>\S+) from \S+: (?P<msg>.*)',
+     ':%(nick)s!%(user)s@%(host)s PRIVMSG %(chan)s :\x01%(ctcp)s %(msg)s\x01'),
+    (r'-!- (?P<nick>\S+) \[(?P<user>[^@]*)@(?P<host>\S*)\] has joined '
+     r'(?P<target>\S+)',
+     ':%(nick)s!%(user)s@%(host)s JOIN %(target)s'),
+    (r'-!- (?P<nick>\S+) \[(?P<user>[^@]*)@(?P<host>\S*)\] has left '
+     r'(?P<target>\S+)',
+     ':%(nick)s!%(user)s@%(host)s PART %(target)s'),
+    (r'-!- (?P<victim>\S+) was kicked from (?P<target>\S+) by (?P<nick>\S+) '
+     r'\[(?P<msg>.*)\]',
+     ':%(nick)s!%(nick)s@replay KICK %(target)s %(victim)s :%(msg)s'),
+    (r'-!- (?P<nick>\S+) changed the topic of (?P<target>\S+) to: (?P<msg>.*)',
+     ':%(nick)s!%(nick)s@replay TOPIC %(target)s :%(msg)s'),
+    (r'-!- (?P<nick>\S+) has quit \[(?P<msg>.*)\]',
+     ':%(nick)s!%(nick)s@replay QUIT :%(msg)s'),
+    (r'-!- mode/(?P<target>\S+) \[(?P<modes>.*)\] by (?P<nick>\S+)',
+     ':%(nick)s!%(nick)s@replay MODE %(target)s %(modes)s'),
+]
+LOG_FORMATS = [(re.compile(regex + '$'), raw) for regex, raw in LOG_FORMATS]
+
+
+def log_to_raw(line, chan):
+    "turns a line from a plugins/log.py log back into a raw irc line"
+    if chan is not None and not line.startswith(':'):
+        for regex, raw in LOG_FORMATS:
+            match = regex.match(line)
+            if match:
+                fields = match.groupdict()
+                fields['chan'] = chan
+                return raw % fields
+    return line  # unformatted lines are logged raw
+
+
+def test_log_to_raw():
+    assert log_to_raw('<bob> .seen al', '#test') == \
+        ':bob!bob@replay PRIVMSG #test :.seen al'
+    assert log_to_raw('* bob waves', '#test') == \
+        ':bob!bob@replay PRIVMSG #test :\x01ACTION waves\x01'
+    assert log_to_raw('-!- al [u@example.com] has joined #test', '#test') == \
+        ':al!u@example.com JOIN #test'
+    assert log_to_raw('-!- al was kicked from #test by bob [bye]', '#test') \
+        == ':bob!bob@replay KICK #test al :bye'
+    assert log_to_raw(':al!u@h NICK :bo', 'nick') == ':al!u@h NICK :bo'
+    assert log_to_raw('PING :server', None) == 'PING :server'
+
+
+def read_traffic(filename):
+    """yields (seconds since midnight or None, raw line) from either a log
+    written by plugins/log.py or a file of raw lines"""
+    match = LOG_FILENAME_RE.match(os.path.basename(filename))
+    chan = match.group(1) if match else None
+
+    with open(filename, 'rb') as f:
+        for line in f:
+            line = decode(line.rstrip(b'\r\n'))
+            if not line:
+                continue
+
+            seconds = None
+            match = TIMESTAMP_RE.match(line)
+            if match:
+                hours, minutes, secs = map(int, match.groups())
+                seconds = hours * 3600 + minutes * 60 + secs
+                line = line[match.end():]
+
+            yield seconds, log_to_raw(line, chan)
+
+
+class VirtualClock(object):
+
+    "follows the time recorded in the traffic, instead of the wall clock"
+
+    def __init__(self):
+        self.start = None
+        self.now = None
+        self.days = 0
+
+    def advance(self, seconds):
+        if seconds is None:
+            return
+        now = seconds + self.days * 86400
+        if self.now is not None and now < self.now:  # went past midnight
+            self.days += 1
+            now += 86400
+        if self.start is None:
+            self.start = now
+        self.now = now
+
+    def time(self):
+        "the recorded time, or 0 for traffic without timestamps"
+        if self.now is None:
+            return 0
+        return self.now
+
+    def elapsed(self):
+        if self.start is None:
+            return 0
+        return self.now - self.start
+
+
+def plugins_busy():
+    return bot.workers.depth() or bot.workers.in_flight or \
+        any(handler.input_queue.qsize() for handler in bot.threads.values())
+
+
+def replay(filenames):
+    "pushes recorded traffic through main() as fast as possible"
+    bot.config = json.load(open(find_config()))
+    # measure the dispatcher, not the throttling meant for live users
+    bot.config['rate_limits'] = {'user': None, 'channel': None,
+                                 'plugin': None}
+    bot.persist_dir = os.path.join(bot.persist_dir, REPLAY_DIR)
+    if not os.path.exists(bot.persist_dir):
+        os.mkdir(bot.persist_dir)
+    bot.scheduler.filename = os.path.join(bot.persist_dir, SCHEDULE_FILENAME)
+    start_cpu_pool(bot.config.get('cpu_processes', 2))
+    bot.workers.configure(bot.config.get('worker_threads', 16),
+                          bot.config.get('worker_queue', 100),
+                          bot.config.get('plugin_concurrency', 8))
+    bot.workers.blocking = True
+
+    conf = dict(list(bot.config['connections'].values())[0])
+    conf.setdefault('censored_strings', bot.config.get('censored_strings', []))
+    conn = FakeIRC(conf)
+
+    clock = VirtualClock()
+    bot.result_cache.clock = clock.time  # ttls pass in recorded time
+    timings = collections.defaultdict(float)  # stage -> seconds
+    lines = 0
+
+    started = time.time()
+    for filename in filenames:
+        for seconds, raw in read_traffic(filename):
+            clock.advance(seconds)
+
+            parse_start = time.time()
+            out = conn.parse(raw)
+            dispatch_start = time.time()
+            waited = bot.workers.waited
+            main(conn, out)
+            # time blocked on full worker queues isn't dispatch work
+            waited = bot.workers.waited - waited
+            timings['queue wait'] += waited
+            timings['dispatch'] += time.time() - dispatch_start - waited
+            timings['parse'] += dispatch_start - parse_start
+            lines += 1
+
+    dispatched = time.time()
+    while plugins_busy() and time.time() - dispatched < DRAIN_TIMEOUT:
+        time.sleep(.01)
+    finished = time.time()
+
+    timings['read'] = dispatched - started - timings['parse'] - \
+        timings['dispatch'] - timings['queue wait']
+    timings['plugins'] = finished - dispatched
+
+    print('replayed %d lines (%ds of traffic) in %.3fs: %.0f lines/sec' % (
+        lines, clock.elapsed(), dispatched - started,
+        lines / max(dispatched - started, 1e-9)))
+    for stage in ('read', 'parse', 'dispatch', 'queue wait', 'plugins'):
+        print('  %-10s %8.3fs %8.1fus/line' % (
+            stage, timings[stage], timings[stage] * 1e6 / max(lines, 1)))
+    if plugins_busy():
+        print('  plugins still busy after %ds' % DRAIN_TIMEOUT)
+    print('sent: ' + (', '.join('%s %d' % item
+                                for item in sorted(conn.sent.items()))
+                      or 'nothing'))
@@ -0,0 +1,234 @@
+from __future__ import division
+
+import json
+import math
+import os
+import time
+import _thread
+
+
+SCHEDULE_FILENAME = 'schedule.json'
+WHEEL_TICK = .25  # seconds per slot
+WHEEL_SLOTS = 512  # tasks further out than a turn of the wheel wait in place
+RESTORE_DELAY = 60  # seconds after startup that overdue saved tasks run
+RETRY_DELAY = 1  # seconds before retrying a task the workers turned away
+
+
+class Task(object):
+
+    "a call to fn(bot, *args) at a given time, and maybe every interval after"
+
+    __slots__ = ('due', 'fn', 'args', 'interval', 'persist', 'cancelled')
+
+    def __init__(self, due, fn, args=(), interval=None, persist=False):
+        self.due = due
+        self.fn = fn  # or (filename, name) for a task restored from disk
+        self.args = tuple(args)
+        self.interval = interval
+        self.persist = persist
+        self.cancelled = False
+
+    def to_dict(self):
+        filename, name = self.fn if isinstance(self.fn, tuple) else \
+            (self.fn.__code__.co_filename, self.fn.__name__)
+        return {'due': self.due, 'filename': filename, 'name': name,
+                'args': list(self.args)}
+
+    def resolve(self):
+        "finds a restored task's function among the loaded plugins"
+        if not isinstance(self.fn, tuple):
+            return self.fn
+        filename, name = self.fn
+        for plugs in list(bot.plugs.values()):
+            for plug in plugs:
+                if plug[0]._filename == filename:
+                    return plug[0].__globals__[name]
+        raise KeyError('%s is not loaded' % filename)
+
+
+class TaskInput(object):
+
+    "stands in for a line from the server when the workers run a task"
+
+    __slots__ = ('task', 'raw', 'lane')
+
+    def __init__(self, task, func):
+        self.task = task
+        self.raw = 'scheduled %s' % plugin_name(func)  # for thread dumps
+        self.lane = 'normal'
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+
+class TimerWheel(object):
+
+    '''Hashed timer wheel, turned by one thread, that runs scheduled tasks'''
+
+    def __init__(self, filename=None):
+        self.lock = _thread.allocate_lock()
+        self.save_lock = _thread.allocate_lock()  # one writer of the file
+        self.slots = [[] for slot in range(WHEEL_SLOTS)]  # [(tick, task)]
+        self.tick = int(time.time() / WHEEL_TICK)  # last tick processed
+        self.periodic = {}  # func -> Task
+        self.saved = []  # tasks with persist=True
+        self.filename = filename
+        self.submit = submit_task
+
+    def add(self, task):
+        with self.lock:
+            tick = max(int(math.ceil(task.due / WHEEL_TICK)), self.tick + 1)
+            self.slots[tick % WHEEL_SLOTS].append((tick, task))
+
+    def schedule(self, delay, fn, args=(), persist=False):
+        """calls fn(bot, *args) in delay seconds. If persist is set, fn must
+        be a plugin's module-level function and args must be JSON, so the call
+        can be saved and still happen after a restart"""
+        module = getattr(fn, '__globals__', {})
+        if persist and module.get(fn.__name__) is not fn:
+            raise ValueError('only module-level functions can be saved')
+        task = Task(time.time() + delay, fn, args, persist=persist)
+        self.add(task)
+        if persist:
+            with self.lock:
+                self.saved.append(task)
+            self.save()
+        return task
+
+    def cancel(self, task):
+        task.cancelled = True
+        self.forget(task)
+
+    def forget(self, task):
+        if task.persist:
+            with self.lock:
+                if task in self.saved:
+                    self.saved.remove(task)
+            self.save()
+
+    def set_periodic(self, plugs):
+        "starts the tasks of newly loaded @hook.periodic functions"
+        funcs = set(func for func, args in plugs)
+        for func, task in list(self.periodic.items()):
+            if func not in funcs:  # unloaded or reloaded
+                task.cancelled = True
+                del self.periodic[func]
+        for func, args in plugs:
+            if func not in self.periodic:
+                interval = args['interval']
+                task = self.periodic[func] = Task(time.time() + interval,
+                                                  func, interval=interval)
+                self.add(task)
+
+    def advance(self, now):
+        "runs every task that is due by now"
+        due = []
+        with self.lock:
+            while self.tick < int(now / WHEEL_TICK):
+                self.tick += 1
+                slot = self.slots[self.tick % WHEEL_SLOTS]
+                due.extend(task for tick, task in slot if tick <= self.tick)
+                slot[:] = [(tick, task) for tick, task in slot
+                           if tick > self.tick]
+
+        for task in due:
+            if task.cancelled:
+                continue
+            if task.interval:
+                task.due = max(task.due + task.interval, now)
+                self.add(task)
+            if self.submit(task):
+                if not task.interval:
+                    self.forget(task)
+            elif not task.interval:  # try again rather than lose it
+                task.due = now + RETRY_DELAY
+                self.add(task)
+        return due
+
+    def save(self):
+        if self.filename is None:
+            return
+        with self.save_lock:  # so the last write has the latest tasks
+            with self.lock:
+                tasks = [task.to_dict() for task in self.saved]
+            with open(self.filename + '.tmp', 'w') as f:
+                json.dump(tasks, f, indent=2)
+            os.rename(self.filename + '.tmp', self.filename)
+
+    def restore(self):
+        "reschedules the tasks saved before a restart"
+        if self.filename is None or not os.path.exists(self.filename):
+            return
+        soonest = time.time() + RESTORE_DELAY
+        for saved in json.load(open(self.filename)):
+            task = Task(max(saved['due'], soonest),
+                        (saved['filename'], saved['name']), saved['args'],
+                        persist=True)
+            with self.lock:
+                self.saved.append(task)
+            self.add(task)
+
+    def run(self):
+        while True:
+            time.sleep(WHEEL_TICK - time.time() % WHEEL_TICK)
+            try:
+                self.advance(time.time())
+            except Exception:
+                bot.logger.exception('core')
+
+
+def submit_task(task):
+    """hands a due task to the worker pool, so it gets the same limits and
+    timeouts as other plugin calls. returns False if the pool is full"""
+    try:
+        func = task.resolve()
+    except KeyError:
+        bot.logger.exception('plugin', 'error in scheduled task')
+        return True  # its plugin is gone, so don't retry it
+    return bot.workers.submit(func, TaskInput(task, func))
+
+
+def run_task(func, input, owner):
+    "runs a scheduled task on a worker, as run() does a plugin call"
+    call = start_call(func, input, owner)
+    try:
+        func(bot, *input.task.args)
+    except:
+        bot.metrics.record(func, time.time() - call.started, error=True)
+        raise
+    finally:
+        end_call(call)
+    bot.metrics.record(func, time.time() - call.started)
+
+
+def test_timer_wheel():
+    def noop(bot):
+        pass
+
+    wheel = TimerWheel()
+    wheel.submit = lambda task: True
+    now = wheel.tick * WHEEL_TICK
+    soon = Task(now + 1, noop)
+    later = Task(now + WHEEL_SLOTS * WHEEL_TICK + 1, noop)  # a turn later
+    cancelled = Task(now + 1, noop)
+    for task in (soon, later, cancelled):
+        wheel.add(task)
+    cancelled.cancelled = True
+
+    assert wheel.advance(now + .5) == []
+    assert soon in wheel.advance(now + 1)
+    assert later not in wheel.advance(now + WHEEL_SLOTS * WHEEL_TICK)
+    assert wheel.advance(now + WHEEL_SLOTS * WHEEL_TICK + 1) == [later]
+
+    wheel.submit = lambda task: False  # the workers are full
+    busy = Task(now + WHEEL_SLOTS * WHEEL_TICK + 2, noop)
+    wheel.add(busy)
+    assert wheel.advance(busy.due) == [busy]
+    assert wheel.advance(busy.due + RETRY_DELAY) == [busy]  # tried again
+
+
+if not hasattr(bot, 'scheduler'):
+    bot.scheduler = TimerWheel(os.path.join(bot.persist_dir,
+                                            SCHEDULE_FILENAME))
+    bot.schedule = bot.scheduler.schedule
+    _thread.start_new_thread(bot.scheduler.run, ())
@@ -0,0 +1,103 @@
+from __future__ import print_function
+
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import _thread
+
+
+def bottom_frame(frame):
+    while frame.f_back is not None:
+        frame = frame.f_back
+    return frame
+
+
+def thread_label(frame):
+    """names a thread after the method at the bottom of its stack, or returns
+    None if it isn't running one"""
+    frame = bottom_frame(frame)
+    owner = frame.f_locals.get('self')
+    if owner is None or isinstance(owner, threading.Thread):  # has a name
+        return None
+
+    name = '%s.%s' % (type(owner).__name__, frame.f_code.co_name)
+    if isinstance(owner, Handler):
+        name += ' for %s (%d queued)' % (plugin_name(owner.func),
+                                         owner.depth())
+    elif isinstance(owner, crlf_tcp):
+        name += ' for %s:%s' % (owner.host, owner.port)
+    return name
+
+
+def format_thread_dump():
+    "every thread's stack, labelled with the plugin call it is running"
+    now = time.time()
+    names = dict((thread.ident, thread.name)
+                 for thread in threading.enumerate())
+
+    lines = ['thread dump at %s' % time.ctime(now)]
+    for ident, frame in sorted(sys._current_frames().items()):
+        lines.append('')
+        label = thread_label(frame)
+        if label is None:
+            label = names.get(ident)
+        if label is None or label.startswith('Dummy-'):  # not a real name
+            label = bottom_frame(frame).f_code.co_name
+        lines.append('thread %d: %s' % (ident, label))
+        call = bot.calls.get(ident)
+        if call is not None:
+            lines.append('running %s for %.1fs%s on: %s' % (
+                plugin_name(call.func), now - call.started,
+                ' (timed out)' if call.timed_out else '', call.input.raw))
+        lines.extend(line.rstrip('\n')
+                     for line in traceback.format_stack(frame))
+
+    for call in list(bot.calls.values()):
+        if call.coroutine:  # on the event loop's thread
+            lines.append('')
+            lines.append('coroutine %s running for %.1fs on: %s' % (
+                plugin_name(call.func), now - call.started, call.input.raw))
+
+    lines.append('')
+    lines.append('workers: %d threads, %d queued' % (bot.workers.size,
+                                                     bot.workers.depth()))
+    for func, handler in sorted(bot.threads.items(),
+                                key=lambda item: plugin_name(item[0])):
+        lines.append('handler %s: %d queued' % (plugin_name(func),
+                                                handler.depth()))
+    return '\n'.join(lines) + '\n'
+
+
+def dump_threads():
+    "writes a thread dump to persist/, returning its filename"
+    filename = os.path.join(bot.persist_dir, 'threads-%s.txt' %
+                            time.strftime('%Y%m%d-%H%M%S'))
+    with open(filename, 'w') as f:
+        f.write(format_thread_dump())
+    bot.logger.info('core', '### wrote thread dump to %s' % filename)
+    return filename
+
+
+def write_dump():
+    try:
+        dump_threads()
+    except Exception:
+        bot.logger.exception('core')
+
+
+def handle_dump_signal(signum, frame):
+    # the handler interrupts the main thread, which may be holding the
+    # logger's queue lock, so the dump (and its logging) happens elsewhere
+    _thread.start_new_thread(write_dump, ())
+
+
+bot.dump_threads = dump_threads
+
+if hasattr(signal, 'SIGUSR1'):  # kill -USR1 <pid> writes a thread dump
+    try:
+        signal.signal(signal.SIGUSR1, handle_dump_signal)
+    except ValueError:  # only the main thread can set signal handlers
+        pass
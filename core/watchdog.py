@@ -0,0 +1,93 @@
+from __future__ import print_function
+
+import time
+import _thread
+
+
+WATCHDOG_INTERVAL = 1  # seconds between checks on running plugin calls
+
+
+class Call(object):
+
+    "a plugin call in progress"
+
+    __slots__ = ('func', 'input', 'owner', 'thread', 'key', 'coroutine',
+                 'started', 'timeout', 'timed_out', 'reported')
+
+    def __init__(self, func, input, owner, timeout, coroutine=False):
+        self.func = func
+        self.input = input
+        self.owner = owner  # the Handler or WorkerPool running the call
+        self.thread = _thread.get_ident()
+        self.coroutine = coroutine
+        # coroutines share the event loop's thread, so they can't be keyed
+        # by it in bot.calls
+        self.key = ('coroutine', id(self)) if coroutine else self.thread
+        self.started = time.time()
+        self.timeout = timeout
+        self.timed_out = False
+        self.reported = False
+
+
+def call_timeout(func):
+    timeout = getattr(func, '_timeout', None)
+    if timeout is None:
+        timeout = bot.config.get('plugin_timeout', 60)
+    return timeout
+
+
+def start_call(func, input, owner=None, coroutine=False):
+    # coroutines are timed out by asyncio.wait_for, not the watchdog
+    call = Call(func, input, owner, 0 if coroutine else call_timeout(func),
+                coroutine)
+    bot.calls[call.key] = call
+    return call
+
+
+def end_call(call):
+    bot.calls.pop(call.key, None)
+
+
+def time_out(call):
+    call.timed_out = True
+    if call.owner is not None:
+        call.owner.abandon(call.thread)
+
+    message = '%s timed out after %ds' % (
+        getattr(call.input, 'trigger', plugin_name(call.func)), call.timeout)
+    if 'cache_key' in call.input:  # don't leave identical calls waiting
+        bot.result_cache.fail(call.input.cache_key, message)
+    if 'trigger' in call.input:  # someone is waiting on a command
+        call.input.reply(message)
+
+
+def check_calls():
+    now = time.time()
+    threshold = bot.config.get('watchdog_threshold', 30)
+
+    for call in list(bot.calls.values()):
+        elapsed = now - call.started
+        if call.timeout and elapsed > call.timeout and not call.timed_out:
+            time_out(call)
+
+        if threshold and elapsed > threshold and not call.reported:
+            call.reported = True
+            queued = call.owner.depth() if call.owner is not None else 0
+            bot.logger.warning('core', '### watchdog: %s has been running '
+                               'for %ds (%d queued behind it) on: %s' % (
+                                   plugin_name(call.func), elapsed, queued,
+                                   call.input.raw))
+
+
+def watchdog():
+    while True:
+        time.sleep(WATCHDOG_INTERVAL)
+        try:
+            check_calls()
+        except Exception:
+            bot.logger.exception('core')
+
+
+if not hasattr(bot, 'calls'):
+    bot.calls = {}  # thread id (or a coroutine's key) -> Call
+    _thread.start_new_thread(watchdog, ())
@@ -10,6 +10,7 @@ import unittest
 from util import hook
 
 
+@hook.cpu_bound
 @hook.command
 def bf(inp, max_steps=1000000, buffer_size=5000):
     ".bf <prog> -- executes brainfuck program <prog>"""
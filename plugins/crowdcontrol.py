@@ -2,7 +2,6 @@
 # Bot must have some sort of op or admin privileges to be useful
 
 import re
-import time
 from util import hook
 
 # Use "crowdcontrol" array in config
@@ -14,8 +13,15 @@ from util import hook
 #   ban_length: Integer. (optional) Length of time (seconds) to ban user. (-1 to never unban, 0 to not ban, > 1 for time)
 
 
-@hook.regex(r'.*')
-def crowdcontrol(inp, kick=None, ban=None, unban=None, reply=None, bot=None):
+def lift_ban(bot, server, chan, mask):
+    for conn in bot.conns.values():
+        if conn.server_host == server:
+            conn.cmd('MODE', [chan, '-b', mask])
+
+
+@hook.regex(r'.*', ratelimit=False, shed=False)
+def crowdcontrol(inp, kick=None, ban=None, unban=None, reply=None, bot=None,
+                 server='', chan='', host=''):
     inp = inp.group(0)
     for rule in bot.config.get('crowdcontrol', []):
         if re.search(rule['re'], inp) is not None:
@@ -29,5 +35,6 @@ def crowdcontrol(inp, kick=None, ban=None, unban=None, reply=None, bot=None):
             elif 'msg' in rule:
                 reply(reason)
             if ban_length > 0:
-                time.sleep(ban_length)
-                unban()
+                # saved, so the ban is still lifted after a restart
+                bot.schedule(ban_length, lift_ban, (server, chan, host),
+                             persist=True)
@@ -36,6 +36,7 @@ def nrolls(count, n):
                                              (((n + 1) * (2 * n + 1) / 6. - (.5 * (1 + n)) ** 2) * count) ** .5))]
 
 
+@hook.cpu_bound
 @hook.command('roll')
 #@hook.regex(valid_diceroll, re.I)
 @hook.command
@@ -5,6 +5,7 @@ import re
 from util import hook, http
 
 
+@hook.cached(ttl=600)
 @hook.command('u')
 @hook.command
 def urban(inp):
@@ -25,6 +26,7 @@ def urban(inp):
 
 
 # define plugin by GhettoWizard & Scaevolus
+@hook.cached(ttl=3600)
 @hook.command('dictionary')
 @hook.command
 def define(inp):
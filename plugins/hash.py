@@ -3,19 +3,23 @@ import hashlib
 from util import hook
 
 
+@hook.cpu_bound
 @hook.command('md5')
 def hash_md5(inp):
     return hashlib.md5(inp.encode('utf-8')).hexdigest()
 
 
+@hook.cpu_bound
 @hook.command('sha1')
 def hash_sha1(inp):
     return hashlib.sha1(inp.encode('utf-8')).hexdigest()
 
+@hook.cpu_bound
 @hook.command('sha256')
 def hash_sha256(inp):
     return hashlib.sha256(inp.encode('utf-8')).hexdigest()
 
+@hook.cpu_bound
 @hook.command
 def hash(inp):
     """.hash <text> -- returns hashes of <text>"""
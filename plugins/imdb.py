@@ -5,6 +5,7 @@ from util import hook, http
 
 
 # http://www.omdbapi.com/apikey.aspx
+@hook.cached(ttl=3600)
 @hook.api_key('omdbapi')
 @hook.command
 def imdb(inp, api_key=None):
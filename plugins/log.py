@@ -84,6 +84,12 @@ def get_log_fd(dir, server, chan):
     return fd
 
 
+@hook.periodic(60)
+def flush_logs(bot):
+    for filename, fd in list(log_fds.values()):
+        fd.flush()
+
+
 @hook.singlethread
 @hook.event('*')
 def log(paraml, input=None, bot=None):
@@ -103,4 +109,5 @@ def log(paraml, input=None, bot=None):
         fd = get_log_fd(bot.persist_dir, input.server, input.chan)
         fd.write(timestamp + ' ' + beau + '\n')
 
-    print(timestamp, input.chan, beau)
+    bot.logger.info('irc', '%s %s %s' % (timestamp, input.chan, beau),
+                    server=input.server, chan=input.chan)
@@ -1,6 +1,5 @@
 import socket
 import subprocess
-import time
 
 from util import hook, http
 
@@ -41,15 +40,21 @@ def invite(paraml, conn=None):
 
 
 @hook.event('004')
-def onjoin(paraml, conn=None):
+def onjoin(paraml, conn=None, bot=None):
     # identify to services
     nickserv_password = conn.nickserv_password
     nickserv_name = conn.nickserv_name
     nickserv_command = conn.nickserv_command
     if nickserv_password:
-        conn.msg(nickserv_name, nickserv_command % nickserv_password)
-        time.sleep(1)
+        conn.msg(nickserv_name, nickserv_command % nickserv_password,
+                 'protocol')
+        # give services a moment to identify us before joining
+        bot.schedule(1, finish_join, (conn,))
+    else:
+        finish_join(bot, conn)
+
 
+def finish_join(bot, conn):
     # set mode on self
     mode = conn.user_mode
     if mode:
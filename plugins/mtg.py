@@ -10,6 +10,7 @@ def card_search(name):
             return card 
     return random.choice(matching_cards['cards'])
 
+@hook.cached(ttl=3600)
 @hook.command
 def mtg(inp, say=None):
     '''.mtg <name> - Searches for Magic the Gathering card given <name>
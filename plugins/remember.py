@@ -107,20 +107,23 @@ def forget(inp, chan='', db=None):
 def get_page(data, start_idx, min_page_len, max_page_len):
     """
     slices the data string, starting at start_idx, into a chunk no longer
-    than max_page_len. The slice will occur at a comma if the resulting
-    string would not be shorter than min_page_len.
+    than max_page_len bytes of utf-8. The slice will occur at a comma if the
+    resulting string would not be shorter than min_page_len.
     returns a tuple of (result str, slice index)
     """
     page_data = data[start_idx:start_idx + max_page_len]
+    # drop the characters that don't fit, including a split last one
+    page_data = page_data.encode('utf-8')[:max_page_len].decode('utf-8',
+                                                                'ignore')
+    end_idx = start_idx + len(page_data)
 
-    if len(page_data) < max_page_len:
-        return page_data, len(page_data) + start_idx
+    if end_idx == len(data):
+        return page_data, end_idx
 
     last_comma_idx = page_data.rfind(',')
 
     if last_comma_idx < min_page_len:
-        ret = data[start_idx:max_page_len + start_idx]
-        return ret, len(ret) + start_idx
+        return page_data, end_idx
 
     end_idx = last_comma_idx + start_idx
     return data[start_idx:end_idx], end_idx
@@ -139,10 +142,10 @@ def get_pages(data, min_page_len, max_page_len):
 
 more_pages_message = ' (%s page(s) left)'
 page_missing_message = "%s only has %s page(s)"
-message_len_limit = 512 - len(more_pages_message) - 75 # fudge factor for protocol overhead
+message_len_limit = 400  # when the connection can't say how much fits in a line
 
-@hook.regex(r'^\? ?(\S+) ?(\d+)?')
-def question(inp, chan='', say=None, db=None):
+@hook.regex(r'^\? ?(\S+) ?(\d+)?', shed=False)
+def question(inp, chan='', say=None, db=None, conn=None):
     "?<word> [page] -- shows what data is associated with word, paginated by page (default 1)"
     db_init(db)
 
@@ -156,7 +159,12 @@ def question(inp, chan='', say=None, db=None):
 
     data = get_memory(db, chan, word)
     if data:
-        pages = get_pages(data, min_page_len, message_len_limit)
+        max_page_len = message_len_limit
+        if conn is not None:
+            # room for the suffix with the largest possible page count
+            max_page_len = conn.max_message_len(chan) - \
+                len(more_pages_message % len(data))
+        pages = get_pages(data, min_page_len, max_page_len)
         page_idx = page - 1 # 1-indexed
         try:
             page_data = pages[page_idx]
@@ -265,6 +273,7 @@ class MemoryTest(unittest.TestCase):
         assert get_pages('123,456789', 5, 8) == ['123,4567', '89']
         assert get_pages('123,45,67,89', 5, 8) == ['123,45', ',67,89']
         assert get_pages('', 5, 8) == []
+        assert get_pages(u'\xe9\xe9\xe9\xe9\xe9', 1, 4) == [u'\xe9\xe9'] * 2 + [u'\xe9']
 
     def test_paging_message(self):
         long_string = 'long ' + 'a' * 1000
@@ -288,6 +297,18 @@ class MemoryTest(unittest.TestCase):
         assert all_data.count('x') == message_len_limit
         assert all_data.count('y') == message_len_limit
 
+    def test_page_fits_line(self):
+        class Conn(object):
+            def max_message_len(self, chan):
+                return 40
+
+        self.remember('long ' + 'x' * 5000, chan='#long')
+        output = []
+        question(re.match(r'(\S+) ?(\d+)?', 'long'), chan='#long',
+                 say=output.append, db=self.db, conn=Conn())
+        assert re.search(r'\(\d{3} page', output[0])  # a 3 digit count
+        assert len(output[0].encode('utf-8')) <= 40
+
     def test_missing_page(self):
         long_string = 'long ' + 'a' * 1000
 
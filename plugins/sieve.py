@@ -1,51 +1,188 @@
-from builtins import map
+import collections
 import re
+import time
 
 from util import hook
 
 
+MAX_DECISIONS = 10000  # cached (plugin, server, channel) decisions
+MAX_BUCKETS = 10000  # tracked users, channels and plugins
+
+# [calls, seconds]: allow bursts of up to this many calls, refilling over this
+# many seconds. None means no limit, and limits are only set in the config.
+DEFAULT_RATE_LIMITS = {'user': None, 'channel': None, 'plugin': None}
+
+Acl = collections.namedtuple('Acl', 'allowed_channels denied_channels '
+                                    'whitelist blacklist blacklisted_nicks')
+
+
+def compile_acl(acl):
+    def lowered(key):
+        return frozenset(x.lower() for x in acl.get(key, []))
+
+    return Acl(allowed_channels=lowered('deny-except')
+               if 'deny-except' in acl else None,
+               denied_channels=lowered('allow-except'),
+               whitelist=frozenset(acl['whitelist'])
+               if 'whitelist' in acl else None,
+               blacklist=frozenset(acl.get('blacklist', [])),
+               blacklisted_nicks=lowered('blacklist-nicks'))
+
+
+class SieveConfig(object):
+
+    "the sieve's settings from bot.config, compiled into sets"
+
+    def __init__(self, config):
+        self.config = config
+        self.ignorebots = config.get('ignorebots', True)
+        self.disabled_commands = frozenset(config.get('disabled_commands', []))
+        self.disabled_plugins = frozenset(config.get('disabled_plugins', []))
+        self.ignored = frozenset(config.get('ignored', []))
+        self.acls = dict((name, compile_acl(acl))
+                         for name, acl in config.get('acls', {}).items())
+        self.decisions = {}
+
+    def decide(self, func, server, chan):
+        "returns None if func may not run in chan, else the nicks it ignores"
+        key = (func, server, chan)
+        try:
+            return self.decisions[key]
+        except KeyError:
+            pass
+
+        if len(self.decisions) >= MAX_DECISIONS:
+            self.decisions.clear()
+
+        decision = self.decisions[key] = self._decide(func, server, chan)
+        return decision
+
+    def _decide(self, func, server, chan):
+        fn = re.match(r'^plugins.(.+).py$', func._filename)
+        if fn and fn.group(1).lower() in self.disabled_plugins:
+            return None
+
+        name = func.__name__
+        lchan = chan.lower()
+        blacklisted_nicks = frozenset()
+        for acl in [self.acls.get(name), self.acls.get(chan),
+                    self.acls.get(server)]:
+            if acl is None:
+                continue
+            if acl.allowed_channels is not None and \
+                    lchan not in acl.allowed_channels:
+                return None
+            if lchan in acl.denied_channels:
+                return None
+            if acl.whitelist is not None and name not in acl.whitelist:
+                return None
+            if name in acl.blacklist:
+                return None
+            blacklisted_nicks |= acl.blacklisted_nicks
+
+        return blacklisted_nicks
+
+
+class TokenBucket(object):
+
+    "holds up to capacity tokens, refilled at rate tokens per second"
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'stamp')
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return self.tokens
+
+    def full(self, now):
+        return self.refill(now) >= self.capacity
+
+
+class RateLimits(object):
+
+    "token buckets per user, channel and plugin, limited by bot.config"
+
+    def __init__(self, config):
+        self.config = config
+        self.limits = []
+        limits = dict(DEFAULT_RATE_LIMITS, **config.get('rate_limits', {}))
+        for scope in ('user', 'channel', 'plugin'):
+            if limits.get(scope):
+                calls, seconds = limits[scope]
+                self.limits.append((scope, calls, float(calls) / seconds))
+        self.buckets = {}
+        self.dropped = 0
+
+    def key(self, scope, input, func):
+        if scope == 'user':
+            return scope, input.server, input.host or input.nick
+        if scope == 'channel':
+            return scope, input.server, input.chan.lower()
+        return scope, func
+
+    def allow(self, input, func, now=None):
+        "takes a token from each of the call's buckets, if they all have one"
+        if now is None:
+            now = time.time()
+
+        if len(self.buckets) >= MAX_BUCKETS:
+            self.prune(now)
+
+        buckets = []
+        for scope, capacity, rate in self.limits:
+            key = self.key(scope, input, func)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(capacity, rate, now)
+            if bucket.refill(now) < 1:
+                self.dropped += 1
+                return False
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+        return True
+
+    def prune(self, now):
+        "forgets buckets that have refilled, as they're the same as new ones"
+        for key, bucket in list(self.buckets.items()):
+            if bucket.full(now):
+                del self.buckets[key]
+
+
+def get_sieve_config(bot):
+    memo = getattr(get_sieve_config, 'memo', None)
+    if memo is None or memo.config is not bot.config:  # config was reloaded
+        memo = get_sieve_config.memo = SieveConfig(bot.config)
+    return memo
+
+
 @hook.sieve
 def sieve_suite(bot, input, func, kind, args):
-    if input.command == 'PRIVMSG' and \
-       bot.config.get('ignorebots', True) and \
+    conf = get_sieve_config(bot)
+
+    if input.command == 'PRIVMSG' and conf.ignorebots and \
        input.nick.lower()[-3:] == 'bot' and args.get('ignorebots', True):
             return None
 
     if kind == "command":
-        if input.trigger in bot.config.get('disabled_commands', []):
+        if input.trigger in conf.disabled_commands:
             return None
 
-        ignored = bot.config.get('ignored', [])
-        if input.host in ignored or input.nick in ignored:
+        if input.host in conf.ignored or input.nick in conf.ignored:
             return None
 
-    fn = re.match(r'^plugins.(.+).py$', func._filename)
-    disabled = bot.config.get('disabled_plugins', [])
-    if fn and fn.group(1).lower() in disabled:
+    blacklisted_nicks = conf.decide(func, input.server, input.chan)
+    if blacklisted_nicks is None or input.nick.lower() in blacklisted_nicks:
         return None
 
-    acls = bot.config.get('acls', {})
-    for acl in [acls.get(func.__name__), acls.get(input.chan), acls.get(input.server)]:
-        if acl is None:
-            continue
-        if 'deny-except' in acl:
-            allowed_channels = list(map(str.lower, acl['deny-except']))
-            if input.chan.lower() not in allowed_channels:
-                return None
-        if 'allow-except' in acl:
-            denied_channels = list(map(str.lower, acl['allow-except']))
-            if input.chan.lower() in denied_channels:
-                return None
-        if 'whitelist' in acl:
-            if func.__name__ not in acl['whitelist']:
-                return None
-        if 'blacklist' in acl:
-            if func.__name__ in acl['whitelist']:
-                return None
-        if 'blacklist-nicks' in acl:
-            if input.nick.lower() in acl['blacklist-nicks']:
-                return None
-
     admins = input.conn.admins
     input.admin = input.host in admins or input.nick in admins
 
@@ -54,3 +191,25 @@ def sieve_suite(bot, input, func, kind, args):
             return None
 
     return input
+
+
+def get_rate_limits(bot):
+    memo = getattr(get_rate_limits, 'memo', None)
+    if memo is None or memo.config is not bot.config:  # config was reloaded
+        memo = get_rate_limits.memo = RateLimits(bot.config)
+    return memo
+
+
+@hook.sieve
+def sieve_rate_limit(bot, input, func, kind, args):
+    if kind not in ('command', 'regex') or not args.get('ratelimit', True):
+        return input
+
+    admins = input.conn.admins
+    if input.host in admins or input.nick in admins:
+        return input
+
+    if not get_rate_limits(bot).allow(input, func):
+        return None
+
+    return input
@@ -0,0 +1,90 @@
+from __future__ import division
+
+from util import hook
+
+
+def format_time(seconds):
+    if seconds < 1:
+        return '%dms' % (seconds * 1000)
+    return '%.1fs' % seconds
+
+
+def format_stats(name, stats, uptime):
+    if not stats.get('calls'):
+        out = '%s: no calls, %d queued' % (name, stats.get('queued', 0))
+    else:
+        out = '%s: %d calls (%.1f/min), %d errors, avg %s, p95 <%s, max %s' % (
+            name, stats['calls'], stats['calls'] * 60 / uptime,
+            stats['errors'], format_time(stats['total_time'] / stats['calls']),
+            format_time(stats['p95']), format_time(stats['max_time']))
+        if 'queued' in stats:
+            out += ', %d queued' % stats['queued']
+    if 'shed' in stats:
+        out += ', %d shed' % stats['shed']
+    return out
+
+
+@hook.command(adminonly=True, autohelp=False)
+def stats(inp, bot=None, pm=None):
+    ".stats [plugin] -- shows the busiest plugins, or details of matching ones"
+    snapshot = bot.metrics.snapshot()
+    plugins = snapshot['plugins']
+    uptime = snapshot['uptime']
+
+    if inp:
+        names = sorted(name for name in plugins if inp.lower() in name.lower())
+        if not names:
+            return 'no stats for %s' % inp
+        for name in names[:5]:
+            pm(format_stats(name, plugins[name], uptime))
+        return
+
+    workers = snapshot['workers']
+    pm('workers: %d threads, %d queued, %d dropped, %d shed' % (
+        workers['threads'], workers['queued'], workers['dropped'],
+        workers['shed']))
+    for name, conn in sorted(snapshot['connections'].items()):
+        pm('%s: %d lines sent in %d writes, %d queued, queue wait p95 <%s, '
+           'max %s' % (name, conn['lines'], conn['writes'], conn['queued'],
+                       format_time(conn['latency_p95']),
+                       format_time(conn['latency_max'])))
+    cache = snapshot['cache']
+    pm('cache: %d entries, %d hits, %d misses, %d waits' % (
+        cache['entries'], cache['hits'], cache['misses'], cache['waits']))
+
+    busiest = sorted(plugins, key=lambda name: -plugins[name].get('total_time', 0))
+    for name in busiest[:5]:
+        pm(format_stats(name, plugins[name], uptime))
+
+
+@hook.command(adminonly=True, autohelp=False)
+def threads(inp, bot=None):
+    ".threads -- writes a dump of every thread's stack to persist/"
+    filename = bot.dump_threads()
+    running = len(bot.calls)
+    return 'wrote %s (%d plugin call%s running)' % (
+        filename, running, '' if running == 1 else 's')
+
+
+@hook.command(adminonly=True, autohelp=False)
+def flamegraph(inp, bot=None, pm=None):
+    ".flamegraph [seconds] [samples/sec] -- samples every thread's stacks" \
+        " (default 30s at 100/s) and writes them to persist/ for flamegraph.pl"
+    try:
+        args = [float(arg) for arg in inp.split()]
+        seconds = args[0] if args else 30
+        rate = args[1] if len(args) > 1 else 100
+    except ValueError:
+        return flamegraph.__doc__
+    if not 0 < seconds <= 3600 or not 0 < rate <= 1000:
+        return 'seconds must be at most 3600 and samples/sec at most 1000'
+
+    def done(filename, profiler):
+        top = ', '.join('%s %.1f%%' % (name, count * 100 / profiler.samples)
+                        for name, count in profiler.plugins()[:5])
+        pm('wrote %d samples to %s%s' % (profiler.samples, filename,
+                                         '; plugins: ' + top if top else ''))
+
+    if not bot.start_profile(seconds, rate, done):
+        return 'a profile is already running'
+    return 'profiling for %gs' % seconds
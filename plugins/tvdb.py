@@ -70,6 +70,7 @@ def get_episode_info(episode):
     return (episode_air_date, airdate, episode_desc)
 
 
+@hook.cached(ttl=3600)
 @hook.command
 @hook.command('tv')
 def tv_next(inp):
@@ -68,7 +68,7 @@ def format_reply(history):
     )
 
 
-@hook.regex(r'([a-zA-Z]+://|www\.)[^ ]+')
+@hook.regex(r'([a-zA-Z]+://|www\.)[^ ]+', ratelimit=False)
 def urlinput(match, nick='', chan='', db=None, bot=None):
     db_init(db)
     url = urlnorm.normalize(match.group())
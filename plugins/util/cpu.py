@@ -0,0 +1,69 @@
+# runs @hook.cpu_bound plugins inside the bot's worker processes
+
+import os
+import signal
+
+try:
+    import resource
+except ImportError:  # not on unix, so there's no cpu time limit
+    resource = None
+
+
+plugins = {}  # filename -> (mtime, namespace)
+
+
+class CpuTimeExceeded(Exception):
+    pass
+
+
+def raise_cpu_time_exceeded(signum, frame):
+    raise CpuTimeExceeded()
+
+
+def init_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, raise_cpu_time_exceeded)
+
+
+def load(filename, name):
+    mtime = os.stat(filename).st_mtime
+    if plugins.get(filename, (None,))[0] != mtime:
+        namespace = {}
+        eval(compile(open(filename, 'r').read(), filename, 'exec'), namespace)
+        plugins[filename] = (mtime, namespace)
+    return plugins[filename][1][name]
+
+
+def limit_cpu_time(seconds):
+    "makes the kernel signal SIGXCPU after seconds more of cpu time"
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    return hard
+
+
+def call(filename, name, inp, kwargs, cpu_limit, max_result):
+    "calls the plugin function, returning its reply as text"
+    func = load(filename, name)
+
+    hard = None
+    if resource is not None and cpu_limit:
+        hard = limit_cpu_time(cpu_limit)
+    try:
+        out = func(inp, **kwargs)
+    except CpuTimeExceeded:
+        return 'error: used more than %ss of cpu time' % cpu_limit
+    finally:
+        if hard is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+    if out is None:
+        return None
+    out = '%s' % out
+    if max_result and len(out) > max_result:
+        return 'error: result is longer than %d characters' % max_result
+    return out
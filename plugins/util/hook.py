@@ -34,9 +34,50 @@ def _hook_add(func, add, name=''):
             args.append(0)  # means kwargs present
         func._args = args
 
+    if not hasattr(func, '_call'):
+        func._call = _make_call(func, func._args)
+
+    if not hasattr(func, '_async'):  # is it an async def coroutine function?
+        func._async = bool(getattr(inspect, 'iscoroutinefunction',
+                                   lambda func: False)(func))
+
     if not hasattr(func, '_thread'):  # does function run in its own thread?
         func._thread = False
 
+    if not hasattr(func, '_cpu_bound'):  # does it run in another process?
+        func._cpu_bound = False
+
+
+def _make_call(func, args):
+    # returns a function that calls func with the input's attributes that it
+    # takes as keyword arguments
+    wants_input = 'input' in args
+
+    if not args:
+        def call(input):
+            return func(input.inp)
+    elif 0 in args:  # takes **kwargs, so give it everything
+        def call(input):
+            kw = dict(input)
+            if wants_input:
+                kw['input'] = input
+            return func(input.inp, **kw)
+    else:
+        keys = tuple(key for key in args if key != 'input')
+
+        def call(input):
+            kw = {}
+            for key in keys:
+                try:
+                    kw[key] = getattr(input, key)
+                except AttributeError:  # not set, so use the default
+                    pass
+            if wants_input:
+                kw['input'] = input
+            return func(input.inp, **kw)
+
+    return call
+
 
 def sieve(func):
     if func.__code__.co_argcount != 5:
@@ -46,6 +87,15 @@ def sieve(func):
     return func
 
 
+def periodic(interval):
+    def periodic_wrapper(func):
+        if func.__code__.co_argcount != 1:
+            raise ValueError('periodic functions must take 1 argument: (bot)')
+        _hook_add(func, ['periodic', (func, {'interval': interval})])
+        return func
+    return periodic_wrapper
+
+
 def command(arg=None, **kwargs):
     args = {}
 
@@ -85,6 +135,32 @@ def singlethread(func):
     return func
 
 
+def cpu_bound(func):
+    func._cpu_bound = True
+    return func
+
+
+def concurrency(limit):
+    def annotate(func):
+        func._concurrency = limit
+        return func
+    return annotate
+
+
+def timeout(seconds):
+    def annotate(func):
+        func._timeout = seconds
+        return func
+    return annotate
+
+
+def cached(ttl=300, key=None):
+    def annotate(func):
+        func._cached = {'ttl': ttl, 'key': key}
+        return func
+    return annotate
+
+
 def api_key(*keys):
     def annotate(func):
         func._apikeys = keys
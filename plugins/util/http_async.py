@@ -0,0 +1,32 @@
+# coroutine versions of util.http's getters, for async def plugins. The
+# requests run on the event loop's thread pool, so they behave exactly like
+# util.http's (timeouts, cookies, proxies, compressed responses).
+# python 3 only.
+
+import asyncio
+import functools
+
+from util import http
+
+
+async def run(func, *args, **kwargs):
+    "awaits func(*args, **kwargs) run on the event loop's thread pool"
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args,
+                                                              **kwargs))
+
+
+async def get(*args, **kwargs):
+    return await run(http.get, *args, **kwargs)
+
+
+async def get_html(*args, **kwargs):
+    return await run(http.get_html, *args, **kwargs)
+
+
+async def get_xml(*args, **kwargs):
+    return await run(http.get_xml, *args, **kwargs)
+
+
+async def get_json(*args, **kwargs):
+    return await run(http.get_json, *args, **kwargs)
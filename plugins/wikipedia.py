@@ -14,6 +14,7 @@ random_url = api_prefix + "?action=query&format=xml&list=random&rnlimit=1&rnname
 paren_re = re.compile('\s*\(.*\)$')
 
 
+@hook.cached(ttl=600, key=lambda inp: inp or None)  # .w alone is random
 @hook.command('w')
 @hook.command(autohelp=False)
 def wiki(inp):
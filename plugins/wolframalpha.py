@@ -6,6 +6,7 @@ import re
 from util import hook, http
 
 
+@hook.cached(ttl=60)
 @hook.api_key('wolframalpha')
 @hook.command('wa')
 @hook.command
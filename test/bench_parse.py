@@ -0,0 +1,100 @@
+"""Times core/irc.py's Message parser against the regexes it replaced.
+
+    python test/bench_parse.py [file of raw lines ...]
+
+Without files, a small mix of typical server traffic is parsed.
+"""
+from __future__ import print_function
+
+from os import path
+import re
+import sys
+import timeit
+
+IRC_PREFIX_REM = re.compile(r'(.*?) (.*?) (.*)').match
+IRC_NOPROFEIX_REM = re.compile(r'()(.*?) (.*)').match
+IRC_NETMASK_REM = re.compile(r':?([^!@]*)!?([^@]*)@?(.*)').match
+IRC_PARAM_REF = re.compile(r'(?:^|(?<= ))(:.*|[^ ]+)').findall
+
+SAMPLE_LINES = [
+    ':bob!~bob@user/bob PRIVMSG #python :has anyone used asyncio with irc?',
+    ':alice!alice@192.0.2.7 PRIVMSG #python :.seen bob',
+    ':carol!~c@gateway/web/irccloud.com/x-abc JOIN #python',
+    ':dave!dave@example.net PART #python :Leaving',
+    ':erin!~e@203.0.113.9 QUIT :Ping timeout: 260 seconds',
+    ':irc.example.net 353 skybot = #python :skybot @bob +alice carol dave',
+    ':irc.example.net 005 skybot CHANTYPES=# PREFIX=(ov)@+ :are supported',
+    ':ChanServ!ChanServ@services. MODE #python +o bob',
+    ':bob!~bob@user/bob PRIVMSG #python :\x01ACTION waves\x01',
+    'PING :irc.example.net',
+]
+
+
+def regex_parse(msg):
+    "the parser core/irc.py used before Message"
+    if msg.startswith(":"):  # has a prefix
+        prefix, command, params = IRC_PREFIX_REM(msg).groups()
+    else:
+        prefix, command, params = IRC_NOPROFEIX_REM(msg).groups()
+    nick, user, host = IRC_NETMASK_REM(prefix).groups()
+    paramlist = IRC_PARAM_REF(params)
+    lastparam = ""
+    if paramlist:
+        if paramlist[-1].startswith(':'):
+            paramlist[-1] = paramlist[-1][1:]
+        lastparam = paramlist[-1]
+    return [msg, prefix, command, params, nick, user, host,
+            paramlist, lastparam]
+
+
+def message_fields(message):
+    return [message.raw, message.prefix, message.command, message.params,
+            message.nick, message.user, message.host, message.paraml,
+            message.lastparam]
+
+
+def load_irc():
+    "evaluates core/irc.py the way the bot does"
+    filename = path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                         'core', 'irc.py')
+    namespace = {}
+    eval(compile(open(filename).read(), filename, 'exec'), namespace)
+    return namespace
+
+
+def main(filenames):
+    Message = load_irc()['Message']
+
+    lines = SAMPLE_LINES
+    if filenames:
+        lines = [line.rstrip('\r\n') for filename in filenames
+                 for line in open(filename)]
+        lines = [line for line in lines if line]
+
+    for line in lines:  # both should agree wherever the regexes work
+        if line.startswith('@'):  # tags
+            continue
+        try:
+            expected = regex_parse(line)
+        except AttributeError:  # no params
+            continue
+        assert message_fields(Message(line)) == expected, line
+
+    tagged = ['@time=2020-01-01T00:00:00.000Z;msgid=abc ' + line
+              for line in lines]
+    number = max(1, 200000 // len(lines))
+    timings = [
+        ('regexes', lambda: [regex_parse(line) for line in lines]),
+        ('Message', lambda: [Message(line) for line in lines]),
+        ('Message, tagged', lambda: [Message(line) for line in tagged]),
+        ('Message, tags read',
+         lambda: [Message(line).tags for line in tagged]),
+    ]
+    for name, func in timings:
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print('%-20s %6.2fus/line' % (name,
+                                      seconds * 1e6 / (number * len(lines))))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
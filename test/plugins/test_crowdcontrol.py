@@ -1,9 +1,8 @@
-from collections import namedtuple
 from unittest import TestCase
-from mock import Mock, patch, call
+from mock import Mock, call
 
 from helpers import execute_skybot_regex
-from crowdcontrol import crowdcontrol
+from crowdcontrol import crowdcontrol, lift_ban
 
 class TestCrowdcontrol(TestCase):
     def call_crowd_control(self, input, called=None, rules=None):
@@ -15,9 +14,11 @@ class TestCrowdcontrol(TestCase):
             mocks[name] = Mock(name=name)
 
         config = { 'crowdcontrol': rules } if rules else {}
-        bot = namedtuple('Bot', 'config')(config=config)
+        self.bot = Mock(config=config)
 
-        execute_skybot_regex(crowdcontrol, input, bot=bot, **mocks)
+        execute_skybot_regex(crowdcontrol, input, bot=self.bot,
+                             server='irc.example.com', chan='#test',
+                             host='example.com', **mocks)
 
         return mocks
 
@@ -105,32 +106,42 @@ class TestCrowdcontrol(TestCase):
             else:
                 m.assert_not_called()
 
-    @patch('time.sleep')
-    def test_match_ban_only_time_limit(self, mock_time_sleep):
+    def test_match_ban_only_time_limit(self):
 
         mocks = self.call_crowd_control('Hello world!', rules=[{'re': 'Hello', 'ban_length': 5}])
 
-        mock_time_sleep.assert_called_once_with(5)
+        self.bot.schedule.assert_called_once_with(
+            5, lift_ban, ('irc.example.com', '#test', 'example.com'),
+            persist=True)
 
         for n, m in mocks.items():
-            if n == 'ban' or n == 'unban':
+            if n == 'ban':
                 m.assert_called_once()
             else:
                 m.assert_not_called()
 
-    @patch('time.sleep')
-    def test_match_kick_ban_time_limit(self, mock_time_sleep):
+    def test_match_kick_ban_time_limit(self):
 
         mocks = self.call_crowd_control('Hello world!', rules=[{'re': 'Hello', 'kick': 1, 'ban_length': 5}])
 
-        mock_time_sleep.assert_called_once_with(5)
+        self.bot.schedule.assert_called_once()
 
         for n, m in mocks.items():
-            if n == 'kick' or n == 'ban' or n == 'unban':
+            if n == 'kick' or n == 'ban':
                 m.assert_called_once()
             else:
                 m.assert_not_called()
 
+    def test_lift_ban(self):
+        conn = Mock(server_host='irc.example.com')
+        other = Mock(server_host='irc.other.com')
+        bot = Mock(conns={'example': conn, 'other': other})
+
+        lift_ban(bot, 'irc.example.com', '#test', 'example.com')
+
+        conn.cmd.assert_called_once_with('MODE', ['#test', '-b', 'example.com'])
+        other.cmd.assert_not_called()
+
     def test_match_multiple_rules_in_order(self):
         mocks = self.call_crowd_control(
             'Hello world!',
@@ -0,0 +1,44 @@
+import asyncio
+import threading
+from unittest import TestCase
+from mock import patch
+
+from util import http_async
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestHttpAsync(TestCase):
+    @patch('util.http.get_json')
+    def test_get_json(self, mock_get_json):
+        mock_get_json.return_value = {'ip': '192.0.2.1'}
+
+        result = run(http_async.get_json('https://api.ipify.org',
+                                         format='json'))
+
+        assert result == {'ip': '192.0.2.1'}
+        mock_get_json.assert_called_once_with('https://api.ipify.org',
+                                              format='json')
+
+    @patch('util.http.get')
+    def test_runs_off_the_loop_thread(self, mock_get):
+        threads = []
+        mock_get.side_effect = lambda url: threads.append(
+            threading.current_thread()) or 'body'
+
+        assert run(http_async.get('http://example.com')) == 'body'
+        assert threads[0] is not threading.current_thread()
+
+    @patch('util.http.get_xml')
+    def test_errors_are_raised(self, mock_get_xml):
+        mock_get_xml.side_effect = http_async.http.HTTPError(
+            'http://example.com', 404, 'Not Found', {}, None)
+
+        with self.assertRaises(http_async.http.HTTPError):
+            run(http_async.get_xml('http://example.com'))
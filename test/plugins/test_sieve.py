@@ -0,0 +1,152 @@
+from unittest import TestCase
+from mock import Mock
+
+from sieve import RateLimits, sieve_rate_limit, sieve_suite
+
+
+def plugin(name='hello', filename='plugins/greet.py'):
+    return Mock(__name__=name, _filename=filename)
+
+
+class TestSieve(TestCase):
+    def setUp(self):
+        self.bot = Mock(config={})
+
+    def sieve(self, func=None, kind='command', args=None, nick='alice',
+              host='example.com', chan='#test', server='irc.example.com',
+              trigger='hello', admins=None):
+        input = Mock(command='PRIVMSG', nick=nick, host=host, chan=chan,
+                     server=server, trigger=trigger)
+        input.conn.admins = admins or []
+
+        return sieve_suite(self.bot, input, func or plugin(), kind,
+                           args or {})
+
+    def test_allowed(self):
+        assert self.sieve() is not None
+
+    def test_ignore_bots(self):
+        assert self.sieve(nick='otherbot') is None
+        assert self.sieve(nick='otherbot', args={'ignorebots': False})
+
+        self.bot.config = {'ignorebots': False}
+        assert self.sieve(nick='otherbot') is not None
+
+    def test_disabled_command(self):
+        self.bot.config = {'disabled_commands': ['hello']}
+        assert self.sieve() is None
+        assert self.sieve(trigger='hi') is not None
+
+    def test_ignored(self):
+        self.bot.config = {'ignored': ['mallory', 'evil.example.com']}
+        assert self.sieve(nick='mallory') is None
+        assert self.sieve(host='evil.example.com') is None
+        assert self.sieve(kind='event', nick='mallory') is not None
+
+    def test_disabled_plugin(self):
+        self.bot.config = {'disabled_plugins': ['greet']}
+        assert self.sieve() is None
+        assert self.sieve(plugin(filename='plugins/other.py')) is not None
+
+    def test_deny_except(self):
+        self.bot.config = {'acls': {'hello': {'deny-except': ['#Allowed']}}}
+        assert self.sieve() is None
+        assert self.sieve(chan='#allowed') is not None
+
+    def test_allow_except(self):
+        self.bot.config = {'acls': {'#test': {'allow-except': ['#TEST']}}}
+        assert self.sieve() is None
+        assert self.sieve(chan='#other') is not None
+
+    def test_whitelist_and_blacklist(self):
+        self.bot.config = {'acls': {'irc.example.com': {'whitelist': ['hello']},
+                                    '#test': {'blacklist': ['bye']}}}
+        assert self.sieve() is not None
+        assert self.sieve(plugin('other')) is None
+        assert self.sieve(plugin('bye'), server='irc.other.com') is None
+
+    def test_blacklist_nicks(self):
+        self.bot.config = {'acls': {'#test': {'blacklist-nicks': ['Mallory']}}}
+        assert self.sieve(nick='MALLORY') is None
+        assert self.sieve(nick='alice') is not None
+
+    def test_adminonly(self):
+        args = {'adminonly': True}
+        assert self.sieve(args=args) is None
+        assert self.sieve(args=args, admins=['example.com']).admin
+
+    def test_config_reload(self):
+        func = plugin()
+        assert self.sieve(func) is not None
+
+        self.bot.config = {'disabled_plugins': ['greet']}
+        assert self.sieve(func) is None
+
+
+class TestRateLimit(TestCase):
+    def setUp(self):
+        self.bot = Mock(config={'rate_limits': {'user': [2, 10],
+                                                'channel': [3, 10]}})
+
+    def allow(self, limits, nick='alice', host='example.com', chan='#test',
+              func=None, now=0):
+        input = Mock(server='irc.example.com', nick=nick, host=host, chan=chan)
+        return limits.allow(input, func or plugin(), now)
+
+    def test_user_limit(self):
+        limits = RateLimits(self.bot.config)
+        assert self.allow(limits)
+        assert self.allow(limits)
+        assert not self.allow(limits)
+        assert self.allow(limits, host='other.com')
+        assert limits.dropped == 1
+
+    def test_refill(self):
+        limits = RateLimits(self.bot.config)
+        assert self.allow(limits)
+        assert self.allow(limits)
+        assert not self.allow(limits, now=4)
+        assert self.allow(limits, now=5)
+
+    def test_channel_limit(self):
+        limits = RateLimits(self.bot.config)
+        for host in ['a', 'b', 'c']:
+            assert self.allow(limits, host=host)
+        assert not self.allow(limits, host='d')
+        assert self.allow(limits, host='d', chan='#other')
+
+    def test_rejected_calls_are_free(self):
+        limits = RateLimits(self.bot.config)
+        assert self.allow(limits, host='a')
+        assert self.allow(limits, host='a')
+        assert not self.allow(limits, host='a')
+        assert self.allow(limits, host='b')
+        assert not self.allow(limits, host='c')
+
+    def test_no_limits_by_default(self):
+        limits = RateLimits({})
+        for i in range(100):
+            assert self.allow(limits)
+
+    def test_plugin_limit(self):
+        limits = RateLimits({'rate_limits': {'user': None, 'channel': None,
+                                             'plugin': [1, 60]}})
+        func = plugin()
+        assert self.allow(limits, func=func)
+        assert not self.allow(limits, host='other.com', func=func)
+        assert self.allow(limits, func=plugin('other'))
+
+    def test_sieve(self):
+        input = Mock(server='irc.example.com', nick='alice',
+                     host='example.com', chan='#limited')
+        input.conn.admins = []
+        func = plugin('limited')
+        for i in range(2):
+            assert sieve_rate_limit(self.bot, input, func, 'command', {})
+        assert sieve_rate_limit(self.bot, input, func, 'command', {}) is None
+        assert sieve_rate_limit(self.bot, input, func, 'event', {})
+        assert sieve_rate_limit(self.bot, input, func, 'regex',
+                                {'ratelimit': False})
+
+        input.conn.admins = ['example.com']
+        assert sieve_rate_limit(self.bot, input, func, 'command', {})